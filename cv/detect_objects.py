@@ -9,7 +9,19 @@ stored and installed Mask r-CNN (see below) with the appropriate weights and
 labels files.
 
 The script outputs a pickled dataframe containing object detections, confidences
-unique objects and object counts.
+unique objects and object counts. If the images have a 512px variant written
+by resize_photos.py --profiles, the variant is read instead and not resized
+again. Images that cannot be read are skipped.
+
+Long runs can be checkpointed (see checkpoint.py). Detections are then flushed
+to disk every few hundred images, and a stopped run or a run on an input with
+new photos detects objects only in the photos missing from the checkpoint.
+
+On CPU nodes with many cores the work can be split between several worker
+processes, each running its own model on its own part of the photos (see
+data_parallel.py). The outputs of the workers are merged in photo id order,
+and the throughput and scaling efficiency of every run are logged in
+scaling.csv in the output directory.
 
 
 USAGE
@@ -18,6 +30,26 @@ USAGE
 Run this script by typing:
     python detect_objects.py -w file.h5 -l file.txt -i input.pkl -o output.pkl
 
+Detect objects only for new and changed photos of a master merge (see
+combine_data.py) by typing:
+    python detect_objects.py -w file.h5 -l file.txt -i input.pkl -o output.pkl -de delta.csv
+
+Read the images from the packed arrays of resize_photos.py --pack instead of
+separate image files by typing:
+    python detect_objects.py -w file.h5 -l file.txt -i input.pkl -o output.pkl -pk path/to/resized/directory
+
+Photos missing from the packed arrays are skipped.
+
+Flush detections to a checkpoint directory every 500 images by typing:
+    python detect_objects.py -w file.h5 -l file.txt -i input.pkl -o output.pkl -cp checkpoint/ -ce 500
+
+Run 8 worker processes with 4 threads each by typing:
+    python detect_objects.py -w file.h5 -l file.txt -i input.pkl -o output.pkl -j 8 -th 4
+
+Process only shard 3 of 64 by the hash of the photo ids, e.g. as a worker of
+queue_worker.py, by typing:
+    python detect_objects.py -w file.h5 -l file.txt -i input.pkl -o output_3.pkl -sd 3/64
+
 
 NOTES
 =====
@@ -53,8 +85,21 @@ import colorsys
 import argparse
 import imutils
 import random
+import time
 import cv2
 import os
+import sys
+
+# make the shared modules of the preprocessing scripts importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, 'preprocessing'))
+from gpkg_sql import read_delta
+from resize_utils import variant_path, variant_root
+from image_pack import PackReader
+from checkpoint import Checkpoint
+from data_parallel import (take_part_frame, default_threads, run_parts,
+                           merge_parts, report_scaling, part_siblings)
+from work_queue import take_shard_frame
 
 # construct the argument parse and parse the arguments
 ap = argparse.ArgumentParser()
@@ -66,8 +111,44 @@ ap.add_argument("-i", "--input", required=True,
 	help="path to input dataframe to apply Mask R-CNN to")
 ap.add_argument("-o", "--output", required=True,
 	help="path to output pickle")
+ap.add_argument("-de", "--delta",
+	help="delta file from combine_data.py --master, processes only inserted "
+	"and updated photos")
+ap.add_argument("-pk", "--pack",
+	help="path to output directory of resize_photos.py --pack to read images "
+	"from")
+ap.add_argument("-cp", "--checkpoint",
+	help="path to checkpoint directory to flush detections to and to continue "
+	"previous runs from")
+ap.add_argument("-ce", "--checkpointevery", type=int, default=500,
+	help="number of images between checkpoint flushes, default 500")
+ap.add_argument("-j", "--jobs", type=int, default=1,
+	help="number of data-parallel worker processes, default 1")
+ap.add_argument("-th", "--threads", type=int,
+	help="number of intra-op threads per worker process, default number of "
+	"cores divided by jobs")
+ap.add_argument("-pa", "--part",
+	help="part k/N of the photos to process, set by --jobs for its worker "
+	"processes")
+ap.add_argument("-sd", "--shard",
+	help="shard k/N of the photos to process, by the hash of their photo id, "
+	"for work queue workers")
 args = vars(ap.parse_args())
 
+# start time of run for the scaling report
+start = time.time()
+
+# run data-parallel worker processes and merge their outputs in photo id order
+if args['jobs'] > 1:
+	threads = args['threads'] or default_threads(args['jobs'])
+	print('[INFO] - Running ' + str(args['jobs']) + ' worker processes...')
+	run_parts(args['jobs'], threads, {'-o': args['output'], '-cp': args['checkpoint']})
+	df = merge_parts(args['output'], args['jobs'])
+	df.to_pickle(args['output'])
+	report_scaling(args['output'], 'detect_objects.py', args['jobs'], threads,
+		len(df), time.time() - start)
+	sys.exit()
+
 # load the class label names from disk, one label per line
 CLASS_NAMES = open(args['labels']).read().strip().split("\n")
 
@@ -106,9 +187,38 @@ model.load_weights(args['weights'], by_name=True)
 # read pickle in
 df = pd.read_pickle(args['input'])
 
+# keep only new and changed photos of a master merge
+if args['delta'] is not None:
+	df = df[df['photoid'].isin(read_delta(args['delta']))]
+
 # reset index from umap clustering
 df = df.reset_index(drop=True)
 
+# take the shard of the photos of a work queue worker
+if args['shard'] is not None:
+	df = take_shard_frame(df, args['shard'])
+
+# take the part of the photos of a data-parallel worker
+if args['part'] is not None:
+	df = take_part_frame(df, args['part'])
+
+# skip photos done in previous runs
+if args['checkpoint'] is not None:
+	checkpoint = Checkpoint(args['checkpoint'], args['checkpointevery'],
+		others=part_siblings(args['checkpoint']))
+	done = checkpoint.done()
+	alldf = df
+	df = df[~df['photoid'].isin(done)].reset_index(drop=True)
+	print('[INFO] - Skipping ' + str(len(alldf) - len(df)) + ' photos done in previous runs')
+
+# open packed array of resized images and drop photos missing from it
+if args['pack'] is not None:
+	pack = PackReader(variant_root(args['pack'], 512))
+	missing = ~pack.has(df['photoid'])
+	if missing.any():
+		print('[INFO] - Skipping ' + str(missing.sum()) + ' photos missing from the packed array')
+		df = df[~missing].reset_index(drop=True)
+
 # grab list of imagepaths
 print('[INFO] - Loading image paths..')
 imagePaths = df['imagepath'].values.tolist()
@@ -123,19 +233,35 @@ pbar = progressbar.ProgressBar(maxval=len(df), widgets=widgets).start()
 # empty list for predictions
 predprobs = []
 
+# list of unreadable images
+unreadable = []
+
 # loop over images in batches
 for i in range(len(imagePaths)):
     # get path of image
-    imagePath = df['imagepath'][i]
+    imagePath = variant_path(df['imagepath'][i], 512)
     
-    # load input image
-    image = cv2.imread(imagePath)
+    # read RGB image from the packed array
+    if args['pack'] is not None:
+        image = pack.take([df['photoid'][i]])[0]
     
-    # convert color scheme to RGB
-    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    else:
+        # load input image
+        image = cv2.imread(imagePath)
+        
+        # skip unreadable image and drop it afterwards
+        if image is None:
+            print('[INFO] - Skipping unreadable image ' + imagePath)
+            unreadable.append(i)
+            predprobs.append([])
+            continue
+        
+        # convert color scheme to RGB
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
     
-    # resize to 512 x 512
-    image = imutils.resize(image, width=512)
+    # resize to 512 x 512 unless already pre-sized
+    if image.shape[1] != 512:
+        image = imutils.resize(image, width=512)
     
     # detect objects in image
     predictions = model.detect([image])
@@ -161,6 +287,11 @@ for i in range(len(imagePaths)):
         # combine detections with confidences and append to list
         preds = list(zip(objects, probs))
         predprobs.append(preds)
+        
+        # add detections to checkpoint
+        if args['checkpoint'] is not None:
+            checkpoint.add(pd.DataFrame({'photoid': [df['photoid'][i]],
+                                         'obj_preds': [preds]}))
     
     # update progress
     pbar.update(i)
@@ -168,6 +299,15 @@ for i in range(len(imagePaths)):
 # save predictions to dataframe
 df['obj_preds'] = predprobs
 
+# drop unreadable images
+df = df.drop(unreadable).reset_index(drop=True)
+
+# gather detections of all runs from the checkpoint
+if args['checkpoint'] is not None:
+	checkpoint.close()
+	rows = checkpoint.results()
+	df = alldf.merge(rows.drop_duplicates('photoid', keep='last'), on='photoid')
+
 # finish progressbar
 pbar.finish()
 print("[INFO] - Object detection done!")
@@ -205,4 +345,9 @@ for i, row in df.iterrows():
 
 # save dataframe
 df.to_pickle(args['output'])
+
+# report throughput of a single process run, not of a part or shard
+if args['part'] is None and args['shard'] is None:
+	report_scaling(args['output'], 'detect_objects.py', 1, os.cpu_count(),
+		len(df), time.time() - start)
 print("[INFO] - ... done!")
\ No newline at end of file
@@ -12,7 +12,24 @@ model is provided by Grigorios Kalliatakis at:
     https://github.com/GKalliatakis/Keras-VGG16-places365.
 
 In order to run, the script requires the model available from repository
-mentioned above and a pickle containing filepaths to image files.
+mentioned above and a pickle containing filepaths to image files. If the
+images have a 224px variant written by resize_photos.py --profiles, the variant
+is read instead. Images that cannot be read are skipped. Batches are loaded on
+worker threads while the model runs on the previous batch.
+
+Long runs can be checkpointed (see checkpoint.py). Predictions are then flushed
+to disk every few batches, and a stopped run or a run on an input with new
+photos predicts only the photos missing from the checkpoint.
+
+On CPU nodes with many cores the work can be split between several worker
+processes, each running its own model on its own part of the photos (see
+data_parallel.py). The outputs of the workers are merged in photo id order,
+and the throughput and scaling efficiency of every run are logged in
+scaling.csv in the output directory.
+
+The same scene predictions can also be made while extracting features with
+extract_features.py --places, which decodes every image only once for both
+models.
 
 USAGE
 =====
@@ -20,10 +37,38 @@ USAGE
 Run script by typing:
     python predict_places365.py -i input.pkl -o output.pkl -b 32
 
+Predict scenes only for new and changed photos of a master merge (see
+combine_data.py) by typing:
+    python predict_places365.py -i input.pkl -o output.pkl -de delta.csv
+
+Read the images from the packed arrays of resize_photos.py --pack instead of
+separate image files by typing:
+    python predict_places365.py -i input.pkl -o output.pkl -pk path/to/resized/directory
+
+Photos missing from the packed arrays are skipped.
+
+Load images on 8 threads and keep up to 16 batches ready by typing:
+    python predict_places365.py -i input.pkl -o output.pkl -w 8 -pf 16
+
+The loader and model times are reported at the end. If the model mostly waits
+for the loader, add workers.
+
+Flush predictions to a checkpoint directory every 100 batches by typing:
+    python predict_places365.py -i input.pkl -o output.pkl -cp checkpoint/ -ce 100
+
+Run 4 worker processes with 8 threads each by typing:
+    python predict_places365.py -i input.pkl -o output.pkl -j 4 -th 8
+
+Process only shard 3 of 64 by the hash of the photo ids, e.g. as a worker of
+queue_worker.py, by typing:
+    python predict_places365.py -i input.pkl -o output_3.pkl -sd 3/64
+
 @author: tuomvais
 """
 
 import os
+import sys
+import time
 import progressbar
 import pandas as pd
 import numpy as np
@@ -33,6 +78,19 @@ from keras.preprocessing.image import img_to_array
 from keras.preprocessing.image import load_img
 import argparse
 
+# make the shared modules of the preprocessing scripts importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, 'preprocessing'))
+from gpkg_sql import read_delta
+from image_index import IMAGE_ERRORS
+from batch_loader import BatchLoader
+from resize_utils import variant_path, variant_root
+from image_pack import PackReader
+from checkpoint import Checkpoint
+from data_parallel import (take_part_frame, default_threads, run_parts,
+                           merge_parts, report_scaling, part_siblings)
+from work_queue import take_shard_frame
+
 # define arguments
 ap = argparse.ArgumentParser()
 ap.add_argument('-i','--input',required=True,
@@ -41,21 +99,90 @@ ap.add_argument('-o','--output',required=True,
                 help='path to output pickle')
 ap.add_argument('-b','--batchsize', type=int, default=32,
                 help='batch size of images to be passed through network, default 32')
+ap.add_argument('-de','--delta',
+                help='delta file from combine_data.py --master, processes only '
+                'inserted and updated photos')
+ap.add_argument('-pk','--pack',
+                help='path to output directory of resize_photos.py --pack to read '
+                'images from')
+ap.add_argument('-w','--workers', type=int, default=4,
+                help='number of image loading threads, default 4')
+ap.add_argument('-pf','--prefetch', type=int, default=4,
+                help='number of batches loaded ahead of the model, default 4')
+ap.add_argument('-cp','--checkpoint',
+                help='path to checkpoint directory to flush predictions to and to '
+                'continue previous runs from')
+ap.add_argument('-ce','--checkpointevery', type=int, default=50,
+                help='number of batches between checkpoint flushes, default 50')
+ap.add_argument('-j','--jobs', type=int, default=1,
+                help='number of data-parallel worker processes, default 1')
+ap.add_argument('-th','--threads', type=int,
+                help='number of intra-op threads per worker process, default '
+                'number of cores divided by jobs')
+ap.add_argument('-pa','--part',
+                help='part k/N of the photos to process, set by --jobs for its '
+                'worker processes')
+ap.add_argument('-sd','--shard',
+                help='shard k/N of the photos to process, by the hash of their '
+                'photo id, for work queue workers')
 args = vars(ap.parse_args())
 
+# start time of run for the scaling report
+start = time.time()
+
+# run data-parallel worker processes and merge their outputs in photo id order
+if args['jobs'] > 1:
+    threads = args['threads'] or default_threads(args['jobs'])
+    print('[INFO] - Running ' + str(args['jobs']) + ' worker processes...')
+    run_parts(args['jobs'], threads, {'-o': args['output'], '-cp': args['checkpoint']})
+    df = merge_parts(args['output'], args['jobs'])
+    df.to_pickle(args['output'])
+    report_scaling(args['output'], 'predict_places365.py', args['jobs'], threads,
+                   len(df), time.time() - start)
+    sys.exit()
+
 # read pickle in
 print('[INFO] - Reading pickle in')
 df = pd.read_pickle(args['input'])
 
+# keep only new and changed photos of a master merge
+if args['delta'] is not None:
+    df = df[df['photoid'].isin(read_delta(args['delta']))]
+
 # reset index from umap clustering
 df = df.reset_index(drop=True)
 
+# take the shard of the photos of a work queue worker
+if args['shard'] is not None:
+    df = take_shard_frame(df, args['shard'])
+
+# take the part of the photos of a data-parallel worker
+if args['part'] is not None:
+    df = take_part_frame(df, args['part'])
+
+# skip photos done in previous runs
+if args['checkpoint'] is not None:
+    checkpoint = Checkpoint(args['checkpoint'], args['checkpointevery'],
+                            others=part_siblings(args['checkpoint']))
+    done = checkpoint.done()
+    alldf = df
+    df = df[~df['photoid'].isin(done)].reset_index(drop=True)
+    print('[INFO] - Skipping ' + str(len(alldf) - len(df)) + ' photos done in previous runs')
+
 # initialize model
 model = VGG16_Places365(weights='places')
 
+# open packed array of resized images and drop photos missing from it
+if args['pack'] is not None:
+    pack = PackReader(variant_root(args['pack'], 224))
+    missing = ~pack.has(df['photoid'])
+    if missing.any():
+        print('[INFO] - Skipping ' + str(missing.sum()) + ' photos missing from the packed array')
+        df = df[~missing].reset_index(drop=True)
+
 # grab list of imagepaths
 print('[INFO] - Loading images..')
-imagePaths = df['imagepath'].values.tolist()
+imagePaths = [variant_path(p, 224) for p in df['imagepath'].values.tolist()]
 
 # download classlabels if not present in directory
 file_name = 'categories_places365.txt'
@@ -88,35 +215,56 @@ pbar = progressbar.ProgressBar(maxval=len(df), widgets=widgets).start()
 # empty list for predictions
 predictions = []
 
-# loop over images in batches
-print('[INFO] - Starting scene prediction...')
-for i in np.arange(0, len(imagePaths), bs):
+# list of unreadable images
+unreadable = []
+
+def load_batch(i):
+    """Load and preprocess the batch of images starting at row i."""
     
     # extract batch of images and labels then initialize the list of actual images
     # that will be passed through the network for feature extraction
-    batchPaths = df['imagepath'][i:i + bs].values.tolist()
+    batchPaths = imagePaths[i:i + bs]
     batchLabels = df['photoid'][i:i + bs].values.tolist()
     batchImages = []
     
-    # loop over paths of images in batch
-    for (j, imagePath) in enumerate(batchPaths):
-        
-        # load input image and resize to 224x224
-        image = load_img(imagePath, target_size=(224,224))
-        
-        # convert to array
-        image = img_to_array(image)
-        
-        # preprocess image by expanding dimensions and subtracting mean RGB pixel
-        # intensity
-        image = np.expand_dims(image, axis=0)
-        image = preprocess_input(image)
-        
-        # add the image to the batch
-        batchImages.append(image)
-        
-    # vertically stack images
-    batchImages = np.vstack(batchImages)
+    # read rows of the batch photo ids from the packed array
+    if args['pack'] is not None:
+        return preprocess_input(pack.take(batchLabels).astype('float32'))
+    
+    else:
+        # loop over paths of images in batch
+        for (j, imagePath) in enumerate(batchPaths):
+            
+            # load input image and resize to 224x224, use a blank image in
+            # place of an unreadable one and drop it afterwards
+            try:
+                image = load_img(imagePath, target_size=(224,224))
+            except IMAGE_ERRORS:
+                print('[INFO] - Skipping unreadable image ' + imagePath)
+                unreadable.append(imagePath)
+                image = np.zeros((224,224,3))
+            
+            # convert to array
+            image = img_to_array(image)
+            
+            # preprocess image by expanding dimensions and subtracting mean RGB pixel
+            # intensity
+            image = np.expand_dims(image, axis=0)
+            image = preprocess_input(image)
+            
+            # add the image to the batch
+            batchImages.append(image)
+            
+        # vertically stack images
+        return np.vstack(batchImages)
+
+# load batches on worker threads ahead of the model
+loader = BatchLoader(load_batch, np.arange(0, len(imagePaths), bs),
+                     workers=args['workers'], prefetch=args['prefetch'])
+
+# loop over images in batches
+print('[INFO] - Starting scene prediction...')
+for i, batchImages in loader:
     
     # pass the batch images through network and get predictions
     batchPredictions = model.predict(batchImages, batch_size=bs)
@@ -148,6 +296,12 @@ for i in np.arange(0, len(imagePaths), bs):
         # append image predictions to list of all predictions
         predictions.append(predlist)
     
+    # add predictions of readable images to checkpoint
+    if args['checkpoint'] is not None:
+        batch = pd.DataFrame({'photoid': df['photoid'][i:i + bs].values,
+                              'scenepreds': predictions[-len(batchPredictions):]})
+        checkpoint.add(batch[~pd.Series(imagePaths[i:i + bs]).isin(unreadable).values])
+    
     # update progressbar
     pbar.update(i)
 
@@ -156,8 +310,18 @@ df['scenepreds'] = predictions
 
 # finish progressbar
 pbar.finish()
+print('[INFO] - ' + loader.summary())
 print('[INFO] - Predictions saved to dataframe')
 
+# drop unreadable images
+df = df[~pd.Series(imagePaths).isin(unreadable)].reset_index(drop=True)
+
+# gather predictions of all runs from the checkpoint
+if args['checkpoint'] is not None:
+    checkpoint.close()
+    rows = checkpoint.results()
+    df = alldf.merge(rows.drop_duplicates('photoid', keep='last'), on='photoid')
+
 # get best predictions
 for i in range(len(df)):
     df.at[i, 'scenecat'] = df.at[i, 'scenepreds'][0][0]
@@ -167,4 +331,9 @@ for i in range(len(df)):
 print('[INFO] - Saving results to pickle...')
 df.to_pickle(args['output'])
 
+# report throughput of a single process run, not of a part or shard
+if args['part'] is None and args['shard'] is None:
+    report_scaling(args['output'], 'predict_places365.py', 1, os.cpu_count(),
+                   len(df), time.time() - start)
+
 print('[INFO] - ... done!')
\ No newline at end of file
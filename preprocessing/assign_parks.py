@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 21:15:47 2026
+
+INFORMATION
+===========
+
+This script assigns posts to national parks by their point geometries. Posts
+are matched against the polygons of a park boundary file with a bulk query of
+an STRtree spatial index, so all points are assigned in one vectorized call
+instead of testing every point against every park.
+
+Park polygons can be buffered to include posts just outside the boundaries,
+e.g. at parking lots and visitor centres. The buffer distance is given in the
+units of the coordinate system of the posts, so use a projected coordinate
+system such as ETRS-TM35FIN (EPSG:3067) for distances in metres. A post within
+several buffered parks is assigned to the nearest one.
+
+The park name is saved in the column Nimi by default, the column used by
+join_userdata.py, and posts outside all parks get an empty value.
+
+
+USAGE
+=====
+Run the script by running the following command:
+
+    python3 assign_parks.py -i yourdata.gpkg -p parks.gpkg -o output.gpkg
+
+Include posts within 500 metres of a park and drop posts outside parks by
+running:
+
+    python3 assign_parks.py -i yourdata.gpkg -p parks.gpkg -o output.gpkg -b 500 -d
+
+"""
+
+import argparse
+import numpy as np
+import pandas as pd
+import shapely
+from shapely import STRtree
+from gpkg_io import read_gpkg, write_gpkg
+
+
+# Set up the argument parser
+ap = argparse.ArgumentParser()
+
+# Define the path to input file
+ap.add_argument("-i", "--input", required=True,
+                help="Path to geopackage file of posts")
+
+# Define the path to park boundaries
+ap.add_argument("-p", "--parks", required=True,
+                help="Path to park boundary file")
+
+# Define the park name column of park boundaries
+ap.add_argument("-pn", "--parkname", default='Nimi',
+                help="Name of the park name column in park boundary file, default Nimi")
+
+# Define the park name column of output
+ap.add_argument("-c", "--column", default='Nimi',
+                help="Name of the park name column in output, default Nimi")
+
+# Define the buffer distance
+ap.add_argument("-b", "--buffer", type=float, default=0,
+                help="Buffer distance around parks in units of the coordinate "
+                "system of the posts, default 0")
+
+# Define whether posts outside parks are dropped
+ap.add_argument("-d", "--drop", action='store_true',
+                help="Drop posts outside all parks")
+
+# Define the path to output file
+ap.add_argument("-o", "--output", required=True,
+                help="Path to output geopackage file")
+
+# Parse arguments
+args = vars(ap.parse_args())
+
+# read posts and parks in
+print('[INFO] - Reading geopackages in...')
+df = read_gpkg(args['input'])
+parks = read_gpkg(args['parks'], columns=[args['parkname']])
+
+# bring parks to the coordinate system of the posts
+parks = parks.to_crs(df.crs)
+
+# buffer park polygons
+polygons = np.asarray(parks.geometry.values)
+if args['buffer'] > 0:
+    polygons = shapely.buffer(polygons, args['buffer'])
+
+# build spatial index of park polygons
+print('[INFO] - Building spatial index of ' + str(len(parks)) + ' parks...')
+tree = STRtree(polygons)
+
+# query all points at once, returns arrays of post and park positions
+print('[INFO] - Assigning ' + str(len(df)) + ' posts to parks...')
+points = np.asarray(df.geometry.values)
+postidx, parkidx = tree.query(points, predicate='intersects')
+
+# keep the nearest park of posts within several parks
+if len(postidx) > 0:
+    dist = shapely.distance(points[postidx], np.asarray(parks.geometry.values)[parkidx])
+    order = np.lexsort((dist, postidx))
+    postidx, parkidx = postidx[order], parkidx[order]
+    first = np.concatenate(([True], postidx[1:] != postidx[:-1]))
+    postidx, parkidx = postidx[first], parkidx[first]
+
+# save park names of assigned posts
+names = pd.Series(None, index=range(len(df)), dtype=object)
+names.iloc[postidx] = parks[args['parkname']].values[parkidx]
+df[args['column']] = names.values
+print('[INFO] - ' + str(len(postidx)) + ' posts assigned to parks')
+
+# drop posts outside parks
+if args['drop']:
+    df = df[df[args['column']].notna()]
+
+# save to file
+print('[INFO] - Saving to geopackage...')
+write_gpkg(df, args['output'])
+
+print('[INFO] - ... done!')
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 21:48:22 2026
+
+INFORMATION
+===========
+
+This module contains the prefetching batch loader of extract_features.py and
+predict_places365.py. Batches of images are decoded and preprocessed on worker
+threads while the model runs on the previous batch, so neither the cores nor
+the model sit idle waiting for each other. Image decoding in Pillow and most
+numpy operations release the GIL, so threads are enough.
+
+At most prefetch batches are loaded ahead of the model, which bounds the memory
+used by waiting batches. The loader measures how long the model waited for
+batches and how long the model itself took, and summary() reports whether the
+run was bound by loading or by the model. If loading dominates, add workers.
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import time
+
+
+class BatchLoader:
+    """Iterate over (batch, loaded batch) tuples in order, loading upcoming
+    batches on worker threads."""
+
+    def __init__(self, load, batches, workers=4, prefetch=4):
+        self.load = load
+        self.batches = list(batches)
+        self.workers = workers
+        self.prefetch = max(prefetch, 1)
+        self.wait_time = 0.0
+        self.model_time = 0.0
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __iter__(self):
+        pending = deque()
+        upcoming = iter(self.batches)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+
+            # fill the prefetch queue
+            for batch in upcoming:
+                pending.append((batch, pool.submit(self.load, batch)))
+                if len(pending) >= self.prefetch:
+                    break
+
+            while pending:
+                batch, future = pending.popleft()
+
+                # time spent waiting for the loader
+                start = time.perf_counter()
+                loaded = future.result()
+                self.wait_time += time.perf_counter() - start
+
+                # queue the next batch before handing this one to the model
+                for nextbatch in upcoming:
+                    pending.append((nextbatch, pool.submit(self.load, nextbatch)))
+                    break
+
+                # time spent by the model on this batch
+                start = time.perf_counter()
+                yield batch, loaded
+                self.model_time += time.perf_counter() - start
+
+    def summary(self):
+        """Report the balance between loader waits and model time."""
+        total = self.wait_time + self.model_time
+        share = 100 * self.wait_time / total if total > 0 else 0
+        return ('Model {:.1f} s, waiting for loader {:.1f} s ({:.0f} % of run time), '
+                '{}'.format(self.model_time, self.wait_time, share,
+                            'loader bound, add workers' if share > 10 else 'model bound'))
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 23:02:19 2026
+
+INFORMATION
+===========
+
+This module contains the checkpoints of the computer vision scripts. Results
+are collected batch by batch and flushed every few batches into an append-only
+shard in the checkpoint directory:
+
+    checkpoint/shard_000000_3f9a1c2e.pkl
+    checkpoint/shard_000001_3f9a1c2e.pkl
+
+Every shard holds a pickled dataframe of result rows with a photoid column
+and optionally a .npy array of features with one row per result row, e.g.
+checkpoint/shard_000000_3f9a1c2e.npy. The rows are kept apart from the
+features, so finding the photos done in previous runs reads only the rows, and
+the features are read as memory maps and streamed to their destination one
+shard at a time.
+Shards are written by a background thread, so the model does not wait for the
+disk, and under a temporary name first, so a crash never leaves a half written
+shard behind. The features are written before the rows, which mark the shard
+complete.
+
+When a script is run again with the same checkpoint directory, the photo ids
+already in the shards are skipped and only the remaining photos processed.
+Adding new photos to the input and running again therefore processes only the
+new photos.
+
+Shards of other checkpoint directories can be read along with the own ones,
+e.g. those of the other workers of a data-parallel run (see data_parallel.py),
+whose parts shift when photos are added or the number of workers changes.
+New shards are only written into the own directory.
+
+"""
+
+import pandas as pd
+import numpy as np
+import threading
+import queue
+import glob
+import uuid
+import os
+
+
+# file name pattern of shards in a checkpoint directory, numbered in writing
+# order and suffixed by the writer, so two processes writing into the same
+# directory, e.g. a re-queued shard of work_queue.py, never overwrite each
+# other's shards
+SHARD_NAME = 'shard_{:06d}_{}.pkl'
+
+
+class Checkpoint:
+    """Append-only result shards written by a background thread."""
+
+    def __init__(self, root, every=50, queued=2, others=()):
+        self.root = root
+        self.every = every
+        self.rows = []
+        self.arrays = []
+        self.batches = 0
+        self.error = None
+        os.makedirs(root, exist_ok=True)
+
+        # continue numbering after existing shards
+        self.shards = sorted(glob.glob(os.path.join(root, 'shard_*.pkl')))
+        self.next = len(self.shards)
+        self.writer = uuid.uuid4().hex[:8]
+
+        # read only shards of other checkpoint directories
+        self.others = [path for other in others
+                       for path in sorted(glob.glob(os.path.join(other, 'shard_*.pkl')))]
+
+        # start writer thread with a bounded queue of shards to write
+        self.queue = queue.Queue(maxsize=queued)
+        self.thread = threading.Thread(target=self._write, daemon=True)
+        self.thread.start()
+
+    def _write(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            rows, array, path = item
+            try:
+                if array is not None:
+                    with open(self._array_path(path) + '.tmp', 'wb') as f:
+                        np.save(f, array)
+                    os.replace(self._array_path(path) + '.tmp', self._array_path(path))
+                pd.to_pickle(rows, path + '.tmp')
+                os.replace(path + '.tmp', path)
+            except Exception as e:
+                self.error = e
+
+    @staticmethod
+    def _array_path(path):
+        return os.path.splitext(path)[0] + '.npy'
+
+    def _rows(self, path):
+        rows = pd.read_pickle(path)
+        
+        # shards of earlier versions hold rows and features in one dict
+        if isinstance(rows, dict):
+            rows = rows['rows']
+        return rows
+
+    def _array(self, path):
+        if os.path.exists(self._array_path(path)):
+            return np.load(self._array_path(path), mmap_mode='r')
+        shard = pd.read_pickle(path)
+        return shard['array'] if isinstance(shard, dict) else None
+
+    def done(self, column='photoid'):
+        """Set of photo ids in the shards of previous runs."""
+        return set(v for path in self.others + self.shards
+                   for v in self._rows(path)[column])
+
+    def add(self, rows, array=None):
+        """Add result rows of a batch and their features."""
+        self.rows.append(rows)
+        if array is not None:
+            self.arrays.append(array)
+
+        # flush every few batches
+        self.batches += 1
+        if self.batches >= self.every:
+            self.flush()
+
+    def flush(self):
+        """Hand collected results to the writer thread."""
+        if self.error is not None:
+            raise self.error
+        if self.rows:
+            path = os.path.join(self.root, SHARD_NAME.format(self.next, self.writer))
+            self.queue.put((pd.concat(self.rows, ignore_index=True),
+                            np.vstack(self.arrays) if self.arrays else None, path))
+            self.shards.append(path)
+            self.next += 1
+        self.rows = []
+        self.arrays = []
+        self.batches = 0
+
+    def close(self):
+        """Flush remaining results and wait for the writer thread."""
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def results(self):
+        """Return the result rows of all shards, without their features. Rows
+        of the own shards come last."""
+        if not self.others + self.shards:
+            return pd.DataFrame(columns=['photoid'])
+        return pd.concat([self._rows(path) for path in self.others + self.shards],
+                         ignore_index=True)
+
+    def copy_features(self, keep, out):
+        """Copy the features of the result rows where the boolean array keep
+        is set into consecutive rows of out, e.g. the memory map of a feature
+        store, one shard at a time. keep has a value for every row of
+        results()."""
+        start = 0
+        offset = 0
+        for path in self.others + self.shards:
+            array = self._array(path)
+            if array is None:
+                start += len(self._rows(path))
+                continue
+            mask = keep[start:start + len(array)]
+            n = int(mask.sum())
+            out[offset:offset + n] = array[mask]
+            start += len(array)
+            offset += n
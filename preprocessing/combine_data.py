@@ -9,6 +9,17 @@ This unifies data structures of flickr data collected in January 2019 and data
 collected earlier and extracts the unique photoids from the resulting data.
 Finally it drops duplicates.
 
+With the --chunked option the geopackages are merged inside SQLite instead of
+in memory. Only the needed columns are read, duplicates are dropped through a
+unique index on photoid and the result is written in batches, so memory use
+stays bounded however large the geopackages are.
+
+With the --master option a new harvest is merged into a persistent master
+geopackage instead. New posts are inserted, changed posts updated and
+unchanged posts skipped, in time proportional to the size of the new harvest.
+The photo ids of inserted and updated posts can be written to a delta file,
+which image_download.py and extract_features.py accept to process only them.
+
 
 USAGE
 =====
@@ -16,13 +27,24 @@ Run the script by running the following command:
     
     python3 combine_data.py -df yourdata.gpkg -df2 yourdata2.gpkg -o path/to/file.gpkg
 
+Merge large geopackages with bounded memory by running:
+    
+    python3 combine_data.py -df yourdata.gpkg -df2 yourdata2.gpkg -o path/to/file.gpkg -c
+
+Merge a new harvest into a master geopackage by running:
+    
+    python3 combine_data.py -df yourdata.gpkg -m master.gpkg -de delta.csv
+
 
 @author: tuomvais
 """
 
-import geopandas as gpd
 import pandas as pd
 import argparse
+import os
+import gpkg_sql
+from gpkg_io import read_gpkg, write_gpkg
+from flickr_ids import photoid_from_filename
 
 
 # Set up the argument parser
@@ -33,33 +55,36 @@ ap.add_argument("-df", "--dataframe", required=True,
                 help="Path to new geopacakge")
 
 # Define the path to output directory
-ap.add_argument("-df2", "--dataframe2", required=True,
+ap.add_argument("-df2", "--dataframe2",
                 help="Path to the old geopackage")
 
 # Define the preprocessing strategy
-ap.add_argument("-o", "--output", required=True,
+ap.add_argument("-o", "--output",
                 help="Path to output file.")
 
-# Parse arguments
-args = vars(ap.parse_args())
+# Define the path to master geopackage
+ap.add_argument("-m", "--master",
+                help="Path to master geopackage to merge the new geopackage into")
 
-# read files in
-print('[INFO] - Reading geopackages in...')
-df = gpd.read_file(args['dataframe'])
-df2 = gpd.read_file(args['dataframe2'])
+# Define the path to delta file
+ap.add_argument("-de", "--delta",
+                help="Path to csv file listing inserted, updated and skipped "
+                "photo ids of a master merge")
 
-# function to extract photoid from filename
-def pid_extract(row):
-    elements = row.split('_')
-    photoid = elements[0]
-    return photoid
+# Define the merging strategy
+ap.add_argument("-c", "--chunked", action='store_true',
+                help="Merge inside SQLite in batches instead of in memory")
 
-# run function on dataframe with no photoid
-print('[INFO] - Extracting photo ids..')
-df['photoid'] = df['filename'].apply(pid_extract)
+# Define the batch size of chunked merging
+ap.add_argument("-cs", "--chunksize", type=int, default=100000,
+                help="Rows per batch in chunked merging, default 100000")
 
-# convert photoid to numeric
-df['photoid'] = pd.to_numeric(df['photoid'])
+# Parse arguments
+args = vars(ap.parse_args())
+
+# check that either two geopackages or a master geopackage are given
+if args['master'] is None and (args['dataframe2'] is None or args['output'] is None):
+    ap.error('--dataframe2 and --output are required without --master')
 
 # unify dataframe structure
 dflist = ['id','title','description','date_taken','photo_url','lat','lon','user_id','user_name','photoid','geometry']
@@ -73,23 +98,140 @@ renamedict = {'text':'title',
               'userid':'user_id',
               'username':'user_name'}
 
-# simplify dataframes
-print('[INFO] - Unifying the geodataframe column structure')
-simp_df = df[dflist]
-simp_df2 = df2[df2list]
+# photoid expression of new geopackage
+photoid_sql = "CAST(substr(filename, 1, instr(filename, '_') - 1) AS INTEGER)"
+
+# merge new geopackage into master geopackage
+if args['master'] is not None:
+    
+    # open master and attach new geopackage
+    print('[INFO] - Attaching geopackages...')
+    conn = gpkg_sql.connect(args['master'])
+    gpkg_sql.attach(conn, args['dataframe'], 'new')
+    table, geom, geomtype, srs_id = gpkg_sql.feature_table(conn, 'new')
+    outcols = dflist[:-1]
+    
+    # find the feature table of the master, whatever its layer name
+    mastertables = gpkg_sql.feature_tables(conn, 'main')
+    if len(mastertables) > 1:
+        raise ValueError('master geopackage has several feature tables: ' +
+                         ', '.join(row[0] for row in mastertables))
+    
+    # create master table with unique photoids on first run
+    if not mastertables:
+        print('[INFO] - Creating master geopackage...')
+        types = gpkg_sql.columns(conn, 'new', table)
+        types['photoid'] = 'INTEGER'
+        gpkg_sql.create_feature_table(conn, 'new',
+                                      os.path.splitext(os.path.basename(args['master']))[0],
+                                      [(c, types[c]) for c in outcols],
+                                      'geom', geomtype, srs_id, unique='photoid')
+    
+    # geometries are copied as they are, so coordinate systems must match
+    mastertable, mastergeom, mastertype, master_srs = gpkg_sql.feature_table(conn, 'main')
+    if srs_id != master_srs:
+        raise ValueError('geopackages have different coordinate systems: '
+                         '{} and {}'.format(srs_id, master_srs))
+    
+    # select columns of new geopackage and extract photoid from filename
+    exprs = ['"{}"'.format(c) for c in outcols]
+    exprs[outcols.index('photoid')] = photoid_sql
+    
+    # index photoids of a master written by other tools
+    gpkg_sql.ensure_unique(conn, mastertable, 'photoid')
+    
+    # insert new and update changed posts
+    print('[INFO] - Merging posts into master geopackage...')
+    counts = gpkg_sql.upsert_rows(conn, 'new', table, mastertable,
+                                  [mastergeom] + outcols,
+                                  ['"{}"'.format(geom)] + exprs, 'photoid')
+    print('[INFO] - {inserted} posts inserted, {updated} updated and '
+          '{skipped} skipped'.format(**counts))
+    
+    # save photo ids of the merge
+    if args['delta'] is not None:
+        print('[INFO] - Saving delta file...')
+        gpkg_sql.write_delta(conn, mastertable, 'photoid', args['delta'])
+    conn.close()
+
+# merge geopackages inside SQLite
+elif args['chunked']:
+    
+    # start from an empty output geopackage
+    if os.path.exists(args['output']):
+        os.remove(args['output'])
+    conn = gpkg_sql.connect(args['output'])
+    
+    # attach input geopackages
+    print('[INFO] - Attaching geopackages...')
+    gpkg_sql.attach(conn, args['dataframe'], 'new')
+    gpkg_sql.attach(conn, args['dataframe2'], 'old')
+    table, geom, geomtype, srs_id = gpkg_sql.feature_table(conn, 'new')
+    table2, geom2, geomtype2, srs_id2 = gpkg_sql.feature_table(conn, 'old')
+    
+    # geometries are copied as they are, so coordinate systems must match
+    if srs_id != srs_id2:
+        raise ValueError('geopackages have different coordinate systems: '
+                         '{} and {}'.format(srs_id, srs_id2))
+    
+    # output columns and types follow the new geopackage
+    outcols = dflist[:-1]
+    types = gpkg_sql.columns(conn, 'new', table)
+    types['photoid'] = 'INTEGER'
+    
+    # create output table with unique photoids
+    print('[INFO] - Unifying the geopackage column structure')
+    outtable = os.path.splitext(os.path.basename(args['output']))[0]
+    gpkg_sql.create_feature_table(conn, 'new', outtable,
+                                  [(c, types[c]) for c in outcols],
+                                  'geom', geomtype, srs_id, unique='photoid')
+    
+    # extract photoid from filename and select columns of new geopackage
+    exprs = ['"{}"'.format(c) for c in outcols]
+    exprs[outcols.index('photoid')] = photoid_sql
+    
+    # select and rename columns of old geopackage
+    backdict = dict((v, k) for k, v in renamedict.items())
+    exprs2 = ['"{}"'.format(backdict.get(c, c)) for c in outcols]
+    
+    # copy new posts first so they win over duplicates in the old geopackage
+    print('[INFO] - Copying posts and dropping duplicates...')
+    n = gpkg_sql.copy_rows(conn, 'new', table, outtable, ['geom'] + outcols,
+                           ['"{}"'.format(geom)] + exprs, args['chunksize'])
+    n2 = gpkg_sql.copy_rows(conn, 'old', table2, outtable, ['geom'] + outcols,
+                            ['"{}"'.format(geom2)] + exprs2, args['chunksize'])
+    print('[INFO] - {} posts from new and {} from old geopackage saved'.format(n, n2))
+    conn.close()
+
+# merge geopackages in memory
+else:
+    
+    # read files in
+    print('[INFO] - Reading geopackages in...')
+    df = read_gpkg(args['dataframe'], columns=dflist[:-2] + ['filename'])
+    df2 = read_gpkg(args['dataframe2'], columns=df2list[:-1])
+
+    # extract numeric photoid from filenames of dataframe with no photoid
+    print('[INFO] - Extracting photo ids..')
+    df['photoid'] = photoid_from_filename(df['filename'])
+
+    # simplify dataframes
+    print('[INFO] - Unifying the geodataframe column structure')
+    simp_df = df[dflist]
+    simp_df2 = df2[df2list]
 
-# rename columns
-simp_df2 = simp_df2.rename(columns=renamedict)
+    # rename columns
+    simp_df2 = simp_df2.rename(columns=renamedict)
 
-# join dataframes
-ext_df = simp_df.append(simp_df2, ignore_index=True)
+    # join dataframes
+    ext_df = pd.concat([simp_df, simp_df2], ignore_index=True)
 
-# drop duplicates
-print('[INFO] - Dropping duplicate posts...')
-ext_df = ext_df.drop_duplicates(subset='photoid')
+    # drop duplicates
+    print('[INFO] - Dropping duplicate posts...')
+    ext_df = ext_df.drop_duplicates(subset='photoid')
 
-# save output to file
-print('[INFO] - Saving results to geopackage...')
-ext_df.to_file(args['output'], driver='GPKG')
+    # save output to file
+    print('[INFO] - Saving results to geopackage...')
+    write_gpkg(ext_df, args['output'])
 
 print('[INFO] - ... done!')
\ No newline at end of file
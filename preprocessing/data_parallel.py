@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 23:41:37 2026
+
+INFORMATION
+===========
+
+This module contains the data-parallel mode of the computer vision scripts.
+With --jobs N the script starts itself N times as worker processes with
+--part 0/N to --part N-1/N, waits for them and merges their outputs. Every
+worker sorts the photos by photo id and takes its own contiguous part of
+them, so concatenating the outputs of the parts gives the results in photo id
+order.
+
+Each worker runs its own model with the cores split evenly between the
+workers. Intra-op thread counts are set for TensorFlow, OpenMP and MKL through
+environment variables before the workers start, because TensorFlow fixes
+them when it is first imported. Workers are started as new processes rather
+than forked, as TensorFlow does not survive a fork.
+
+Workers keep their checkpoints in their own directories, e.g. checkpoint.part0,
+but read the checkpoints of all parts and of single process runs with the same
+base path. Photos done by any earlier run are therefore skipped even when
+new photos move the part boundaries or the number of workers changes.
+
+Every run appends its image count, run time and throughput to scaling.csv in
+the output directory. The scaling efficiency of a run is its throughput
+divided by the throughput of the latest single process run of the same script
+times the number of workers, i.e. 100 % means perfectly linear scaling.
+
+"""
+
+from work_queue import merge_pickles
+import pandas as pd
+import subprocess
+import shutil
+import glob
+import re
+import time
+import sys
+import os
+
+
+# file name of the scaling log in an output directory
+SCALING_LOG = 'scaling.csv'
+
+
+def parse_part(part):
+    """Return (part number, number of parts) of a 'k/N' part string."""
+    k, n = part.split('/')
+    return int(k), int(n)
+
+
+def take_part(items, part, key):
+    """Sort items by key and return the contiguous part of a 'k/N' string."""
+    k, n = parse_part(part)
+    items = sorted(items, key=key)
+    size = -(-len(items) // n)
+    return items[k * size:(k + 1) * size]
+
+
+def take_part_frame(df, part, key='photoid'):
+    """Sort a dataframe by key and return the contiguous part of a 'k/N'
+    string."""
+    k, n = parse_part(part)
+    df = df.sort_values(key, kind='stable')
+    size = -(-len(df) // n)
+    return df.iloc[k * size:(k + 1) * size].reset_index(drop=True)
+
+
+def part_path(path, k):
+    """Path of the output of worker k."""
+    return '{}.part{}'.format(path, k)
+
+
+def part_siblings(path):
+    """Checkpoint directories of the other parts of any number of workers and
+    of single process runs sharing the base path of a checkpoint directory."""
+    base = re.sub(r'\.part\d+$', '', path)
+    dirs = [base] + sorted(glob.glob(glob.escape(base) + '.part*'))
+    return [d for d in dirs if os.path.isdir(d) and
+            os.path.abspath(d) != os.path.abspath(path)]
+
+
+def default_threads(jobs):
+    """Cores per worker process."""
+    return max(1, (os.cpu_count() or 1) // jobs)
+
+
+def run_parts(jobs, threads, outputs):
+    """Start the running script as jobs worker processes and wait for them.
+
+    outputs is a dict of output options and paths, e.g. {'-o': 'out.pkl'}.
+    Every worker gets its own part path of every output that is not None.
+    """
+    procs = []
+    for k in range(jobs):
+        argv = [sys.executable] + sys.argv + ['-j', '1', '-pa', '{}/{}'.format(k, jobs)]
+        for option, path in outputs.items():
+            if path is not None:
+                argv += [option, part_path(path, k)]
+
+        # fix thread pools of the worker before its libraries are imported
+        env = dict(os.environ)
+        env.update({'OMP_NUM_THREADS': str(threads), 'MKL_NUM_THREADS': str(threads),
+                    'TF_NUM_INTRAOP_THREADS': str(threads), 'TF_NUM_INTEROP_THREADS': '1'})
+        procs.append(subprocess.Popen(argv, env=env))
+
+    # wait for all workers
+    failed = [k for k, proc in enumerate(procs) if proc.wait() != 0]
+    if failed:
+        raise RuntimeError('worker processes {} failed'.format(failed))
+
+
+def merge_parts(path, jobs, key='photoid'):
+    """Concatenate the pickled outputs of the workers in key order and remove
+    them."""
+    parts = [part_path(path, k) for k in range(jobs)]
+    df = merge_pickles(parts, key)
+    for p in parts:
+        os.remove(p)
+    return df
+
+
+def remove_parts(path, jobs):
+    """Remove the output directories of the workers."""
+    for k in range(jobs):
+        shutil.rmtree(part_path(path, k), ignore_errors=True)
+
+
+def report_scaling(output, script, jobs, threads, images, seconds):
+    """Append a run to the scaling log next to output and print its
+    throughput and scaling efficiency."""
+    path = os.path.join(os.path.dirname(os.path.abspath(output)), SCALING_LOG)
+    throughput = images / seconds if seconds > 0 else 0.0
+
+    # compare to the latest single process run of the same script
+    efficiency = None
+    if os.path.exists(path):
+        log = pd.read_csv(path)
+        single = log[(log['script'] == script) & (log['jobs'] == 1)]
+        if len(single) > 0 and single['throughput'].iloc[-1] > 0:
+            efficiency = throughput / (jobs * single['throughput'].iloc[-1])
+
+    # append run to log
+    row = pd.DataFrame([{'script': script, 'jobs': jobs, 'threads': threads,
+                         'images': images, 'seconds': round(seconds, 1),
+                         'throughput': throughput, 'efficiency': efficiency,
+                         'time': time.strftime('%Y-%m-%d %H:%M:%S')}])
+    row.to_csv(path, mode='a', header=not os.path.exists(path), index=False)
+
+    print('[INFO] - {} images in {:.1f} s with {} workers of {} threads, {:.2f} images/s'
+          .format(images, seconds, jobs, threads, throughput))
+    if efficiency is not None:
+        print('[INFO] - Scaling efficiency {:.0f} % of {} single process runs'
+              .format(100 * efficiency, jobs))
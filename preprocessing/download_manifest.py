@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 10:02:47 2026
+
+INFORMATION
+===========
+
+This module contains a persistent download manifest for image_download.py.
+The manifest is a SQLite database with one row per photo id recording the
+download status, HTTP error, byte size and SHA-1 checksum of the image.
+
+Rows are committed in small batches, so a crash or Ctrl-C loses at most the
+latest batch. When the download is run again, photos already marked as done
+are skipped and only failed or missing photos are requested again.
+
+"""
+
+import sqlite3
+import hashlib
+import time
+
+
+class DownloadManifest:
+    """SQLite backed record of downloaded and failed photos."""
+
+    def __init__(self, path, commit_every=50):
+        self.conn = sqlite3.connect(path)
+        self.commit_every = commit_every
+        self.uncommitted = 0
+
+        # write-ahead log keeps the database consistent if the run is killed
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS photos (
+                                 pid TEXT PRIMARY KEY,
+                                 url TEXT,
+                                 path TEXT,
+                                 status TEXT,
+                                 error TEXT,
+                                 bytes INTEGER,
+                                 sha1 TEXT,
+                                 updated REAL)''')
+        self.conn.commit()
+
+    def _ids(self, status):
+        rows = self.conn.execute('SELECT pid FROM photos WHERE status = ?',
+                                 (status,))
+        return set(row[0] for row in rows)
+
+    def done(self):
+        """Photo ids that have been downloaded succesfully."""
+        return self._ids('done')
+
+    def failed(self):
+        """Photo ids whose latest download attempt failed."""
+        return self._ids('failed')
+
+    def errors(self):
+        """List of (photo id, error) tuples of failed downloads."""
+        return self.conn.execute('SELECT pid, error FROM photos '
+                                 'WHERE status = ?', ('failed',)).fetchall()
+
+    def record(self, pid, url, path, status, error=None, nbytes=None, sha1=None):
+        """Insert or replace the row of a photo."""
+        self.conn.execute('INSERT OR REPLACE INTO photos VALUES (?,?,?,?,?,?,?,?)',
+                          (pid, url, path, status, error, nbytes, sha1, time.time()))
+
+        # commit in batches to keep the number of disk syncs low
+        self.uncommitted += 1
+        if self.uncommitted >= self.commit_every:
+            self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self.uncommitted = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+
+def file_checksum(path, chunk_size=1 << 16):
+    """Return size in bytes and SHA-1 hex digest of a file."""
+    sha1 = hashlib.sha1()
+    nbytes = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+            nbytes += len(chunk)
+    return nbytes, sha1.hexdigest()
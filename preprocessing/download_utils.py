@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 09:12:31 2026
+
+INFORMATION
+===========
+
+This module contains the concurrent download engine used by image_download.py.
+Downloads run on a bounded thread pool and every request waits for a token from
+a per-host token bucket, so the number of requests sent to a single Flickr
+host stays below a fixed rate no matter how many threads are running.
+
+The fetch function is given to the engine as an argument, which means the
+engine can be pointed at a local stand-in server (e.g. python -m http.server)
+for testing.
+
+The module also contains an HTTP session that keeps one pool of keep-alive
+connections per thread, retries transient failures with exponential backoff
+and jitter, streams response bodies to disk in chunks and records the latency
+of every request.
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from urllib.parse import urlsplit, urljoin
+import urllib.error
+import http.client
+import statistics
+import itertools
+import threading
+import hashlib
+import io
+import random
+import time
+import os
+
+
+# response codes that are worth retrying
+TRANSIENT_STATUS = {408, 429, 500, 502, 503, 504}
+
+# response codes that point to another location
+REDIRECT_STATUS = {301, 302, 303, 307, 308}
+
+# flickr size suffixes sharing the secret of the photo url and the length of
+# their longest side, from smallest to largest
+FLICKR_SIZES = [('_m', 240), ('_n', 320), ('_w', 400), ('_z', 640),
+                ('_c', 800), ('_b', 1024)]
+
+
+class TokenBucket:
+    """Thread-safe token bucket allowing `rate` requests per second on average
+    and bursts of up to `burst` requests."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        # loop until a token is available
+        while True:
+            with self.lock:
+
+                # refill the bucket according to time passed since last check
+                now = time.monotonic()
+                self.tokens = min(self.capacity,
+                                  self.tokens + (now - self.stamp) * self.rate)
+                self.stamp = now
+
+                # take a token if one is available
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                # otherwise compute how long until the next token
+                delay = (1 - self.tokens) / self.rate
+
+            # sleep outside the lock so other threads can check the bucket
+            time.sleep(delay)
+
+
+class HostRateLimiter:
+    """Keeps a separate token bucket for every host name."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def wait(self, url):
+        # get host name of url
+        host = urlsplit(url).netloc
+
+        # get or create the bucket of the host
+        with self.lock:
+            bucket = self.buckets.get(host)
+            if bucket is None:
+                bucket = TokenBucket(self.rate, self.burst)
+                self.buckets[host] = bucket
+
+        # block until the host allows a new request
+        bucket.acquire()
+
+
+def size_suffixes(target=None, aspect=4/3):
+    """Return flickr size suffixes to try for a target resolution.
+
+    The first suffix is the smallest size whose shorter side is at least
+    `target` pixels for an image with the given aspect ratio, followed by the
+    larger sizes to fall back to. Without a target only '_b' is returned.
+    """
+    if target is None:
+        return ['_b']
+
+    # smallest sizes whose shorter side covers the target
+    suffixes = [s for s, longest in FLICKR_SIZES if longest / aspect >= target]
+
+    # fall back to the largest size if none is big enough
+    return suffixes or ['_b']
+
+
+def run_concurrently(fetch, jobs, workers=8):
+    """Run fetch(job) for every job on a pool of `workers` threads.
+
+    Yields (job, future) pairs in order of completion. Only a small multiple of
+    `workers` jobs is in flight at any time, so long job lists do not pile up
+    in memory. Call future.result() to get the return value or the raised
+    exception of the job.
+    """
+    jobs = iter(jobs)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+
+        # fill the pool with the first jobs
+        pending = {pool.submit(fetch, job): job
+                   for job in itertools.islice(jobs, workers * 2)}
+
+        # loop until all jobs have been processed
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+            # hand finished jobs back to the caller
+            for future in done:
+                yield pending.pop(future), future
+
+            # replace finished jobs with new ones
+            for job in itertools.islice(jobs, len(done)):
+                pending[pool.submit(fetch, job)] = job
+
+
+class HTTPSession:
+    """Keep-alive HTTP client with retries and latency bookkeeping.
+
+    Connections are kept per thread and per host, so every worker thread of
+    run_concurrently() reuses its own connections. Failed connections are
+    dropped from the pool and reopened on the next attempt.
+    """
+
+    def __init__(self, timeout=30, retries=4, backoff=0.5, max_backoff=30,
+                 chunk_size=1 << 16, limiter=None):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.chunk_size = chunk_size
+        self.limiter = limiter
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.latencies = {True: [], False: []}
+        self.retried = 0
+
+    def _connection(self, scheme, host):
+        # get the connection pool of the current thread
+        pool = getattr(self.local, 'pool', None)
+        if pool is None:
+            pool = self.local.pool = {}
+
+        # reuse an open connection if there is one
+        conn = pool.get((scheme, host))
+        if conn is not None:
+            return conn, True
+
+        # otherwise open a new one
+        if scheme == 'https':
+            conn = http.client.HTTPSConnection(host, timeout=self.timeout)
+        else:
+            conn = http.client.HTTPConnection(host, timeout=self.timeout)
+        pool[(scheme, host)] = conn
+        return conn, False
+
+    def _drop(self, scheme, host):
+        # close and forget a broken connection
+        conn = self.local.pool.pop((scheme, host), None)
+        if conn is not None:
+            conn.close()
+
+    def _wait(self, attempt, retry_after=None):
+        # honour the retry-after header of the server if given
+        if retry_after is not None and retry_after.isdigit():
+            delay = min(self.max_backoff, int(retry_after))
+        else:
+            # exponential backoff with full jitter
+            delay = random.uniform(0, min(self.max_backoff,
+                                          self.backoff * 2 ** attempt))
+        with self.lock:
+            self.retried += 1
+        time.sleep(delay)
+
+    def _get(self, url, out, redirects=5):
+        """Stream the body of url into the file object out.
+
+        Returns number of bytes, SHA-1 hex digest and latency in seconds.
+        """
+        attempt = 0
+        while True:
+            parts = urlsplit(url)
+            path = parts.path + ('?' + parts.query if parts.query else '')
+
+            # wait for the host to allow a new request
+            if self.limiter is not None:
+                self.limiter.wait(url)
+
+            conn, reused = self._connection(parts.scheme, parts.netloc)
+            start = time.monotonic()
+            try:
+                conn.request('GET', path, headers={'Connection': 'keep-alive'})
+                resp = conn.getresponse()
+                latency = time.monotonic() - start
+
+                # follow redirects to other image hosts
+                if resp.status in REDIRECT_STATUS and redirects > 0:
+                    resp.read()
+                    url = urljoin(url, resp.getheader('Location'))
+                    return self._get(url, out, redirects - 1)
+
+                # retry transient server errors
+                if resp.status in TRANSIENT_STATUS and attempt < self.retries:
+                    resp.read()
+                    self._wait(attempt, resp.getheader('Retry-After'))
+                    attempt += 1
+                    continue
+
+                # raise other errors like urllib does, including redirects
+                # left over after the redirect limit
+                if resp.status >= 400 or resp.status in REDIRECT_STATUS:
+                    resp.read()
+                    raise urllib.error.HTTPError(url, resp.status, resp.reason,
+                                                 resp.headers, None)
+
+                # stream body to the output in chunks
+                sha1 = hashlib.sha1()
+                nbytes = 0
+                out.seek(0)
+                out.truncate()
+                for chunk in iter(lambda: resp.read(self.chunk_size), b''):
+                    out.write(chunk)
+                    sha1.update(chunk)
+                    nbytes += len(chunk)
+
+                # record latency by connection type
+                with self.lock:
+                    self.latencies[reused].append(latency)
+
+                return nbytes, sha1.hexdigest(), latency
+
+            except urllib.error.HTTPError:
+                raise
+
+            # connection errors, timeouts and broken responses
+            except (OSError, http.client.HTTPException) as e:
+                self._drop(parts.scheme, parts.netloc)
+
+                # the server may have closed an idle connection, which is
+                # retried at once on a new connection
+                if reused:
+                    continue
+                if attempt >= self.retries:
+                    raise urllib.error.URLError(e)
+                self._wait(attempt)
+                attempt += 1
+
+    def download(self, url, path):
+        """Download url to path. The file is written under a temporary name
+        and renamed when complete, so interrupted downloads leave no partial
+        images behind."""
+        tmp = path + '.part'
+        try:
+            with open(tmp, 'wb') as out:
+                result = self._get(url, out)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        return result
+
+    def fetch(self, url):
+        """Download url into memory. Returns body, SHA-1 and latency."""
+        out = io.BytesIO()
+        nbytes, sha1, latency = self._get(url, out)
+        return out.getvalue(), sha1, latency
+
+    def summary(self):
+        """Return a printable summary of request latencies."""
+        lines = []
+        for reused, name in ((False, 'new connections'), (True, 'reused connections')):
+            lat = self.latencies[reused]
+            if lat:
+                lines.append('{}: {} requests, mean latency {:.3f} s, median {:.3f} s'
+                             .format(name, len(lat), statistics.mean(lat),
+                                     statistics.median(lat)))
+        lines.append('retried attempts: {}'.format(self.retried))
+        return '\n'.join(lines)
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 22:26:51 2026
+
+INFORMATION
+===========
+
+This module contains the feature store written by extract_features.py. Instead
+of a pickled dataframe with 2048 feature columns, the extracted features are
+saved as one contiguous float32 (or float16) matrix in a .npy file and the
+photo metadata as a slim pickled dataframe:
+
+    features/features.npy
+    features/meta.pkl
+
+The metadata has a row column pointing to the feature matrix row of every
+photo. Stages needing only the metadata, such as join_userdata.py, never read
+the features, and reduce_dimensions.py reads the feature matrix as a memory
+map, taking the rows of the joined photos without unpickling a wide frame.
+
+"""
+
+import pandas as pd
+import numpy as np
+import os
+
+
+# file names of the feature matrix and metadata in a feature store directory
+FEATURES_NAME = 'features.npy'
+META_NAME = 'meta.pkl'
+
+
+class FeatureWriter:
+    """Write feature batches into a preallocated feature matrix."""
+
+    def __init__(self, root, n, dim, dtype='float32'):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.features = np.lib.format.open_memmap(os.path.join(root, FEATURES_NAME),
+                                                  mode='w+', dtype=dtype, shape=(n, dim))
+
+    def write(self, start, batch):
+        """Write a batch of features starting at row start."""
+        self.features[start:start + len(batch)] = batch
+
+    def close(self, meta):
+        """Flush the features and save the metadata dataframe, which should
+        have a row column."""
+        self.features.flush()
+        del self.features
+        meta.to_pickle(os.path.join(self.root, META_NAME))
+
+
+class FeatureStore:
+    """Read only access to a feature store."""
+
+    def __init__(self, root):
+        self.root = root
+        self._features = None
+        self._meta = None
+
+    @staticmethod
+    def exists(root):
+        """Check whether a directory is a feature store."""
+        return os.path.exists(os.path.join(root, FEATURES_NAME))
+
+    @property
+    def meta(self):
+        """Slim metadata dataframe, read on first use."""
+        if self._meta is None:
+            self._meta = pd.read_pickle(os.path.join(self.root, META_NAME))
+        return self._meta
+
+    @property
+    def features(self):
+        """Feature matrix as a read only memory map, opened on first use."""
+        if self._features is None:
+            self._features = np.load(os.path.join(self.root, FEATURES_NAME),
+                                     mmap_mode='r')
+        return self._features
+
+    def take(self, rows, dtype='float32'):
+        """Features of the given matrix rows as an in-memory array."""
+        return self.features[np.asarray(rows)].astype(dtype, copy=False)
+
+
+def merge_stores(parts, root, dtype=None, key='photoid'):
+    """Merge the feature stores of data-parallel workers or work queue shards
+    into one, in key order within every part. The data type defaults to that
+    of the parts. Returns the merged metadata."""
+    stores = [FeatureStore(part) for part in parts]
+    writer = FeatureWriter(root, sum(len(store.meta) for store in stores),
+                           stores[0].features.shape[1],
+                           dtype or stores[0].features.dtype)
+
+    # copy the features of every part in key order
+    metas = []
+    offset = 0
+    for store in stores:
+        meta = store.meta.sort_values(key, kind='stable').reset_index(drop=True)
+        writer.write(offset, store.features[meta['row'].values])
+        meta['row'] = np.arange(offset, offset + len(meta))
+        offset += len(meta)
+        metas.append(meta)
+
+    meta = pd.concat(metas, ignore_index=True)
+    writer.close(meta)
+    return meta
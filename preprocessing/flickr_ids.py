@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 14:52:18 2026
+
+INFORMATION
+===========
+
+This module contains the parsers for Flickr photo urls and image file names
+used by every script. All parsers work on whole pandas Series with vectorized
+string methods, and the file name parsers also accept a single string.
+
+A Flickr photo url looks like
+
+    https://live.staticflickr.com/65535/48123456789_0a1b2c3d4e_z.jpg
+
+where 48123456789 is the numeric photo id, 0a1b2c3d4e the secret and _z the
+size suffix. Throughout the scripts 'pid' refers to the photo id and secret
+(48123456789_0a1b2c3d4e), which is also the start of the downloaded file name
+48123456789_0a1b2c3d4e_b.jpg, and 'photoid' to the numeric photo id.
+
+"""
+
+import re
+import pandas as pd
+
+
+# list for wrong image sizes from flickr.photos.getSizes
+WRONG_SIZES = ['_o.jpg', '_o.png', '_o.tif', '_m.jpg','_s.jpg','_q.jpg','_t.jpg','_n.jpg','_z.jpg','_c.jpg']
+
+# pattern matching any of the wrong image sizes
+WRONG_SIZES_RE = '|'.join(re.escape(s) for s in WRONG_SIZES)
+
+# pattern matching the size suffix and file extension of an image file name,
+# e.g. '_b.jpg', '_5k.jpeg' or '.png'
+SUFFIX_RE = r'(?:_(?:[a-z]|[0-9]k))?\.[A-Za-z]+$'
+
+
+def url_filename(urls):
+    """File name part of photo urls."""
+    return urls.str.rsplit('/', n=1).str[-1]
+
+
+def strip_size(names):
+    """Strip size suffix and file extension from urls or file names.
+
+    Names containing one of the wrong image sizes lose six characters
+    (e.g. '_z.jpg'), others only the file extension.
+    """
+    hassize = names.str.contains(WRONG_SIZES_RE, regex=True)
+    return names.str[:-6].where(hassize, names.str[:-4])
+
+
+def pid_from_url(urls):
+    """Photo id and secret of photo urls."""
+    return strip_size(url_filename(urls))
+
+
+def url_stem(urls):
+    """Photo urls without size suffix and file extension, ready for adding
+    the size suffix to download."""
+    return strip_size(urls)
+
+
+def pid_from_filename(fnames):
+    """Photo id and secret of downloaded image file names, stripping the
+    size suffix if there is one and an extension of any length."""
+    if isinstance(fnames, str):
+        return re.sub(SUFFIX_RE, '', fnames)
+    return fnames.str.replace(SUFFIX_RE, '', regex=True)
+
+
+def photoid_from_filename(fnames):
+    """Numeric photo id of image file names."""
+    if isinstance(fnames, str):
+        return int(fnames.split('_')[0])
+    return pd.to_numeric(fnames.str.split('_', n=1).str[0])
+
+
+def path_filename(paths, sep='/'):
+    """File name part of image paths."""
+    return paths.str.rsplit(sep, n=1).str[-1]
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 17:05:33 2026
+
+INFORMATION
+===========
+
+This module contains the geopackage reading and writing functions used by the
+preprocessing scripts. When pyogrio is installed, geopackages are read and
+written through its vectorized Arrow interface instead of the row by row
+default engine of geopandas. Columns can be selected and bounding box and
+attribute filters are pushed down to GDAL, which uses the R-tree spatial index
+of the geopackage for bounding boxes.
+
+Full unfiltered reads can be cached in GeoParquet files in a cache directory,
+so repeated reads of the same file skip GDAL entirely. Caching is off by
+default. Turn it on by setting the GPKG_CACHE environment variable to a cache
+directory, e.g.
+
+    export GPKG_CACHE=/scratch/gpkg_cache
+
+or by passing the directory to read_gpkg(). A cached file is rebuilt whenever
+the geopackage is newer than it. Caching requires pyarrow.
+
+"""
+
+import geopandas as gpd
+import hashlib
+import os
+
+# use pyogrio if available
+try:
+    import pyogrio
+except ImportError:
+    pyogrio = None
+
+# use pyarrow for sidecar files if available
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+# environment variable naming the cache directory of full reads
+CACHE_ENV = 'GPKG_CACHE'
+
+
+def sidecar_path(path, cache):
+    """Path of the cached GeoParquet file of a geopackage in a cache
+    directory, unique to the absolute path of the geopackage."""
+    digest = hashlib.md5(os.path.abspath(path).encode('utf-8')).hexdigest()[:8]
+    return os.path.join(cache, '{}.{}.parquet'.format(os.path.basename(path), digest))
+
+
+def _sidecar_valid(path, cache):
+    sidecar = sidecar_path(path, cache)
+    return (os.path.exists(sidecar) and
+            os.path.getmtime(sidecar) >= os.path.getmtime(path))
+
+
+def _read(path, columns=None, bbox=None, where=None):
+    # read with the vectorized arrow engine
+    if pyogrio is not None:
+        return pyogrio.read_dataframe(path, columns=columns, bbox=bbox,
+                                      where=where, use_arrow=pyarrow is not None)
+
+    # fall back to the default engine
+    kwargs = {}
+    if bbox is not None:
+        kwargs['bbox'] = bbox
+    if where is not None:
+        kwargs['where'] = where
+    df = gpd.read_file(path, **kwargs)
+    if columns is not None:
+        df = df[list(columns) + [df.geometry.name]]
+    return df
+
+
+def read_gpkg(path, columns=None, bbox=None, where=None, cache=None):
+    """Read a geopackage into a GeoDataFrame.
+
+    columns  list of attribute columns to read, default all
+    bbox     (minx, miny, maxx, maxy) tuple to read only features within it
+    where    SQL WHERE clause to read only matching features
+    cache    directory to cache full reads in, default the GPKG_CACHE
+             environment variable or no caching
+    """
+    cache = cache or os.environ.get(CACHE_ENV)
+
+    # filtered reads are pushed down to GDAL, only full reads are cached
+    if (columns is not None or bbox is not None or where is not None or
+            pyarrow is None or not cache):
+        return _read(path, columns, bbox, where)
+
+    # read full geopackage once and cache it
+    sidecar = sidecar_path(path, cache)
+    if _sidecar_valid(path, cache):
+        return gpd.read_parquet(sidecar)
+    df = _read(path)
+    os.makedirs(cache, exist_ok=True)
+    df.to_parquet(sidecar + '.tmp')
+    os.replace(sidecar + '.tmp', sidecar)
+    return df
+
+
+def write_gpkg(df, path):
+    """Write a GeoDataFrame to a geopackage."""
+    if pyogrio is not None:
+        pyogrio.write_dataframe(df, path, driver='GPKG', use_arrow=pyarrow is not None)
+    else:
+        df.to_file(path, driver='GPKG')
+
+    # remove outdated cached read of a previous version of the file
+    cache = os.environ.get(CACHE_ENV)
+    if cache and os.path.exists(sidecar_path(path, cache)):
+        os.remove(sidecar_path(path, cache))
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 15:40:26 2026
+
+INFORMATION
+===========
+
+This module contains helpers for working on GeoPackages directly through their
+SQLite tables. GeoPackage geometries are stored as binary blobs, so rows can be
+copied from one GeoPackage to another inside SQLite without ever loading them
+into Python. This keeps memory use bounded no matter how large the files are.
+
+Input GeoPackages are attached to the connection of the output GeoPackage
+under a schema name, e.g. 'src', and their tables referred to as src.table.
+
+The module also contains the upsert used to merge new harvests into a master
+GeoPackage. It writes a delta file listing the photo ids that were inserted,
+updated or skipped, which the download and computer vision scripts can use to
+process only new or changed photos.
+
+"""
+
+import pandas as pd
+import sqlite3
+import os
+from flickr_ids import pid_from_url
+
+
+# GeoPackage application id ('GPKG') and version 1.2
+GPKG_APPLICATION_ID = 1196444487
+GPKG_USER_VERSION = 10200
+
+# GeoPackage system tables copied from the input
+GPKG_SYSTEM_TABLES = ['gpkg_spatial_ref_sys', 'gpkg_contents', 'gpkg_geometry_columns']
+
+
+def connect(path):
+    """Open an output GeoPackage, creating it if it does not exist. The
+    GeoPackage header of an existing file is left as it is."""
+    new = not os.path.exists(path)
+    conn = sqlite3.connect(path, uri=True)
+    if new:
+        conn.execute('PRAGMA application_id = {}'.format(GPKG_APPLICATION_ID))
+        conn.execute('PRAGMA user_version = {}'.format(GPKG_USER_VERSION))
+    return conn
+
+
+def attach(conn, path, schema):
+    """Attach an input GeoPackage read-only under schema name."""
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    conn.execute('ATTACH DATABASE ? AS {}'.format(schema),
+                 ('file:{}?mode=ro'.format(os.path.abspath(path)),))
+
+
+def feature_tables(conn, schema):
+    """Return list of (table, geometry column, geometry type, srs id) of the
+    feature tables registered in gpkg_contents of a GeoPackage, which is empty
+    for a new file without system tables."""
+    if conn.execute('SELECT 1 FROM {}.sqlite_master WHERE name = ?'.format(schema),
+                    ('gpkg_contents',)).fetchone() is None:
+        return []
+    return conn.execute('SELECT c.table_name, g.column_name, g.geometry_type_name, '
+                        'g.srs_id FROM {0}.gpkg_contents c '
+                        'JOIN {0}.gpkg_geometry_columns g USING (table_name) '
+                        'WHERE c.data_type = ? ORDER BY c.table_name'.format(schema),
+                        ('features',)).fetchall()
+
+
+def feature_table(conn, schema):
+    """Return (table, geometry column, geometry type, srs id) of the first
+    feature table of a GeoPackage."""
+    rows = feature_tables(conn, schema)
+    if not rows:
+        raise ValueError('no feature table in GeoPackage ' + schema)
+    return rows[0]
+
+
+def columns(conn, schema, table):
+    """Return dict of column names and declared types of a table."""
+    rows = conn.execute('PRAGMA {}.table_info("{}")'.format(schema, table))
+    return dict((row[1], row[2]) for row in rows)
+
+
+def create_feature_table(conn, src, table, cols, geom, geomtype, srs_id, unique=None):
+    """Create a feature table and the GeoPackage system tables in the output.
+
+    cols is a list of (name, type) tuples. The system table definitions and
+    spatial reference systems are copied from the attached input src.
+    """
+    # copy system table definitions from input
+    for name in GPKG_SYSTEM_TABLES:
+        if conn.execute('SELECT 1 FROM sqlite_master WHERE name = ?', (name,)).fetchone():
+            continue
+        sql = conn.execute('SELECT sql FROM {}.sqlite_master WHERE name = ?'.format(src),
+                           (name,)).fetchone()[0]
+        conn.execute(sql)
+
+    # copy spatial reference systems
+    conn.execute('INSERT OR IGNORE INTO gpkg_spatial_ref_sys '
+                 'SELECT * FROM {}.gpkg_spatial_ref_sys'.format(src))
+
+    # create feature table with a unique key
+    coldefs = ['fid INTEGER PRIMARY KEY AUTOINCREMENT', '"{}" {}'.format(geom, geomtype)]
+    for name, coltype in cols:
+        coldefs.append('"{}" {}{}'.format(name, coltype,
+                                          ' UNIQUE' if name == unique else ''))
+    conn.execute('CREATE TABLE "{}" ({})'.format(table, ', '.join(coldefs)))
+
+    # register feature table
+    conn.execute('INSERT INTO gpkg_contents (table_name, data_type, identifier, srs_id) '
+                 'VALUES (?, ?, ?, ?)', (table, 'features', table, srs_id))
+    conn.execute('INSERT INTO gpkg_geometry_columns VALUES (?, ?, ?, ?, 0, 0)',
+                 (table, geom, geomtype, srs_id))
+    conn.commit()
+
+
+def copy_rows(conn, src, srctable, table, outcols, exprs, chunksize=100000):
+    """Copy rows from an attached table in batches of chunksize rows.
+
+    outcols are the output column names and exprs the matching SQL expressions
+    over the input columns. Rows clashing with a unique key of the output are
+    skipped, so rows copied first win. Returns the number of rows inserted.
+    """
+    sql = ('INSERT OR IGNORE INTO "{}" ({}) SELECT {} FROM {}."{}" '
+           'WHERE rowid > ? AND rowid <= ?').format(
+               table, ', '.join('"{}"'.format(c) for c in outcols),
+               ', '.join(exprs), src, srctable)
+
+    # rowid range of input table
+    lo, hi = conn.execute('SELECT min(rowid), max(rowid) FROM {}."{}"'
+                          .format(src, srctable)).fetchone()
+    if lo is None:
+        return 0
+
+    # copy and commit one window of rows at a time
+    inserted = 0
+    for start in range(lo - 1, hi, chunksize):
+        cur = conn.execute(sql, (start, start + chunksize))
+        inserted += cur.rowcount
+        conn.commit()
+    return inserted
+
+
+def has_table(conn, table):
+    """Check whether the output database has a table."""
+    return conn.execute('SELECT 1 FROM sqlite_master WHERE name = ?',
+                        (table,)).fetchone() is not None
+
+
+def ensure_unique(conn, table, key):
+    """Create a unique index on key unless the table already has one, e.g.
+    on a master GeoPackage written by GDAL. Fails if key has duplicates."""
+    for row in conn.execute('PRAGMA index_list("{}")'.format(table)).fetchall():
+        if row[2] and [col[2] for col in conn.execute(
+                'PRAGMA index_info("{}")'.format(row[1]))] == [key]:
+            return
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS "{0}_{1}_unique" ON "{0}" ("{1}")'
+                 .format(table, key))
+    conn.commit()
+
+
+def upsert_rows(conn, src, srctable, table, outcols, exprs, key):
+    """Merge rows of an attached table into a table with a unique key.
+
+    Rows with a new key are inserted, rows whose values differ from the stored
+    row are updated and identical rows are skipped. The status of every key is
+    kept in the temporary table delta. Work is proportional to the number of
+    input rows thanks to the unique index on key, see ensure_unique(). Returns
+    a dict of counts.
+    """
+    quoted = ['"{}"'.format(c) for c in outcols]
+
+    # stage projected input rows, keeping the first row of duplicate keys
+    conn.execute('DROP TABLE IF EXISTS temp.stage')
+    conn.execute('CREATE TEMP TABLE stage AS SELECT {} FROM "{}" LIMIT 0'
+                 .format(', '.join(quoted), table))
+    conn.execute('CREATE UNIQUE INDEX temp.stage_key ON stage ("{}")'.format(key))
+    conn.execute('INSERT OR IGNORE INTO stage SELECT {} FROM {}."{}"'
+                 .format(', '.join(exprs), src, srctable))
+
+    # classify staged rows against the stored rows
+    differs = ' OR '.join('m.{0} IS NOT s.{0}'.format(c) for c in quoted)
+    conn.execute('DROP TABLE IF EXISTS temp.delta')
+    conn.execute('CREATE TEMP TABLE delta (key PRIMARY KEY, status TEXT)')
+    conn.execute('INSERT INTO delta SELECT s."{0}", CASE WHEN m."{0}" IS NULL '
+                 'THEN \'inserted\' WHEN {1} THEN \'updated\' ELSE \'skipped\' END '
+                 'FROM stage s LEFT JOIN "{2}" m ON m."{0}" = s."{0}"'
+                 .format(key, differs, table))
+
+    # update changed rows
+    conn.execute('UPDATE "{0}" SET {1} FROM stage s JOIN delta d ON d.key = s."{2}" '
+                 'WHERE d.status = \'updated\' AND "{0}"."{2}" = s."{2}"'
+                 .format(table, ', '.join('{0} = s.{0}'.format(c) for c in quoted), key))
+
+    # insert new rows
+    conn.execute('INSERT INTO "{0}" ({1}) SELECT {2} FROM stage s '
+                 'JOIN delta d ON d.key = s."{3}" WHERE d.status = \'inserted\''
+                 .format(table, ', '.join(quoted),
+                         ', '.join('s.' + c for c in quoted), key))
+    conn.commit()
+
+    # count rows by status
+    counts = dict(conn.execute('SELECT status, count(*) FROM delta GROUP BY status'))
+    return dict((status, counts.get(status, 0))
+                for status in ('inserted', 'updated', 'skipped'))
+
+
+def write_delta(conn, table, key, path, chunksize=100000):
+    """Write the delta of the latest upsert to a csv file with columns key,
+    status, photo_url and pid."""
+    query = ('SELECT d.key AS "{0}", d.status, m.photo_url FROM temp.delta d '
+             'JOIN "{1}" m ON m."{0}" = d.key'.format(key, table))
+    header = True
+    for chunk in pd.read_sql_query(query, conn, chunksize=chunksize):
+        chunk['pid'] = pid_from_url(chunk['photo_url'])
+        chunk.to_csv(path, mode='w' if header else 'a', header=header, index=False)
+        header = False
+
+    # write header only if nothing changed
+    if header:
+        pd.DataFrame(columns=[key, 'status', 'photo_url', 'pid']).to_csv(path, index=False)
+
+
+def read_delta(path, statuses=('inserted', 'updated')):
+    """Return set of photo ids (pid) of a delta file with the given statuses."""
+    delta = pd.read_csv(path, usecols=['status', 'pid'])
+    return set(delta.loc[delta['status'].isin(statuses), 'pid'])
@@ -9,10 +9,39 @@ This script reads a geopackage file containing links to Flickr images,
 downloads the images at the highest standard resolution and divides
 them into directories corresponding to Finnish national parks.
 
+Given a target resolution with --target-size, the script instead downloads the
+smallest Flickr size whose shorter side covers the target (e.g. 224 for
+ResNeXt and VGG16 or 512 for Mask r-CNN) and falls back to larger sizes when
+the smaller one is unavailable or too small.
+
 The script returns a directory with Flickr images and a geopackage containing
 posts with available images. Images that have been removed, set to private or
 are otherwise inaccessible are not included in the resulting geopackage.
 
+With the --resized option the images are streamed straight into the resize
+and center crop step of resize_photos.py and only the cropped images are
+written to disk. Add --keep-originals to save the downloaded images as well.
+
+With the --store option the images are kept in a content-addressed image store
+shared by all harvests. Photos already in the store are not downloaded again,
+which makes re-harvesting a metadata-only operation for them. With --resized
+their resized crops are made from the stored images.
+
+The --fanout option spreads the images of each park over hashed
+subdirectories (e.g. Nuuksi/9f/0c/) so that no directory grows too large.
+Saved images are recorded in an index file (index.sqlite) in the output
+directory, which later stages read instead of listing the directories.
+
+Images are downloaded on several threads. Each Flickr host gets at most
+--rate requests per second, by default the pace of the old one-at-a-time
+download, so the speedup comes from overlapping the latency of requests and
+from spreading them over several hosts. Raise --rate and --burst explicitly
+only when the host allows it.
+
+Progress is recorded in a SQLite manifest in the output directory. If the
+download is interrupted, running the same command again skips the images that
+were already downloaded and retries only the failed ones.
+
 
 USAGE
 =====
@@ -20,18 +49,29 @@ Execute the script by running the following command:
     
     python3 image_download.py -i yourdata.gpkg -o output/directory/ -gp yourdata2.gpkg
 
+Download and resize in one pass by running:
+    
+    python3 image_download.py -i yourdata.gpkg -o output/directory/ -gp yourdata2.gpkg -rs resized/directory/
+
 NOTE
 ====
 
 @author: tuomvais
 """
 
-import geopandas as gpd
-import urllib
+import urllib.error
 import os
-import time
-import random
+import io
 import argparse
+from PIL import Image
+from resize_utils import resize_crop, resize_file
+from download_utils import HostRateLimiter, HTTPSession, run_concurrently, size_suffixes
+from download_manifest import DownloadManifest
+from image_store import ImageStore
+from image_index import ImageIndex, shard_dir
+from flickr_ids import pid_from_url, url_stem
+from gpkg_sql import read_delta
+from gpkg_io import read_gpkg, write_gpkg
 
 
 # Set up the argument parser
@@ -53,6 +93,60 @@ ap.add_argument("-o", "--outpath", required=True,
 ap.add_argument("-gp", "--geopackage", required=True,
                 help="Name of the geopackage file to be saved")
 
+# Define the number of simultaneous downloads
+ap.add_argument("-w", "--workers", type=int, default=8,
+                help="Number of concurrent downloads, default 8")
+
+# Define the request rate per host
+ap.add_argument("-r", "--rate", type=float, default=0.75,
+                help="Maximum requests per second per host, default 0.75, "
+                "matching the old one-at-a-time pacing. Raise only if the host allows it")
+
+# Define the burst size of the rate limiter
+ap.add_argument("-bu", "--burst", type=int, default=1,
+                help="Number of requests allowed in a burst per host, default 1")
+
+# Define the request timeout
+ap.add_argument("-t", "--timeout", type=float, default=30,
+                help="Seconds to wait for a response before retrying, default 30")
+
+# Define the number of retries
+ap.add_argument("-re", "--retries", type=int, default=4,
+                help="Number of retries for transient errors, default 4")
+
+# Define the resolution the images are needed in
+ap.add_argument("-ts", "--target-size", type=int, default=None,
+                help="Shorter side in pixels the images need for computer vision, "
+                "e.g. 224 or 512. Default downloads 1024 x 768 images")
+
+# Define the output directory of streamed resized images
+ap.add_argument("-rs", "--resized", default=None,
+                help="Resize and crop images in memory and save them to this "
+                "directory instead of saving the downloaded images")
+
+# Define whether to keep downloaded images when streaming
+ap.add_argument("-ko", "--keep-originals", action='store_true',
+                help="Also save downloaded images when using --resized")
+
+# Define the shared image store
+ap.add_argument("-st", "--store", default=None,
+                help="Path to a content-addressed image store shared by harvests")
+
+# Define the depth of hashed subdirectories
+ap.add_argument("-fo", "--fanout", type=int, default=0,
+                help="Levels of hashed subdirectories per park, e.g. 2 for "
+                "park/ab/cd/. Default 0 saves images directly in park directories")
+
+# Define the path to the delta file of a master merge
+ap.add_argument("-de", "--delta", default=None,
+                help="Delta file from combine_data.py --master, downloads only "
+                "inserted and updated posts")
+
+# Define the path to the download manifest
+ap.add_argument("-m", "--manifest", default=None,
+                help="Path to download manifest, default download_manifest.sqlite "
+                "in the output directory")
+
 # Parse arguments
 args = vars(ap.parse_args())
 
@@ -61,126 +155,225 @@ outgp = args['outpath'] + args['geopackage']
 
 # read file in
 print('[INFO] - Reading geopackage in...')
-df = gpd.read_file(args['input'])
+df = read_gpkg(args['input'])
 
-# make list of parknames and urls
-imglist = list(zip(df[args['parkname']] ,df.photo_url))
+# create full photoid column
+df['pid'] = pid_from_url(df['photo_url'])
 
-# set up error journal to track lost posts/images
-errorlist = []
+# keep only new and changed posts of a master merge
+if args['delta'] is not None:
+    df = df[df['pid'].isin(read_delta(args['delta']))]
+    print('[INFO] - ' + str(len(df)) + ' new or changed posts in delta file')
 
-# set up running progress indicator numbers
-i = 1
-imgcount = len(imglist) 
+# make list of parknames, urls without size suffixes and photo ids
+imglist = list(zip(df[args['parkname']], url_stem(df['photo_url']), df['pid']))
+
+# open manifest to track downloaded and lost posts/images
+manifest = DownloadManifest(args['manifest'] or
+                            os.path.join(args['outpath'], 'download_manifest.sqlite'))
+
+# get photo ids already downloaded in previous runs
+donelist = manifest.done()
+
+# open the shared image store and get photo ids already held in it
+store = None
+heldlist = set()
+if args['store'] is not None:
+    store = ImageStore(args['store'])
+    heldlist = store.held()
+
+# index of saved images, unless they are kept only in the image store
+index = None
+if args['resized'] is not None:
+    index = ImageIndex(args['resized'])
+elif store is None:
+    index = ImageIndex(args['outpath'])
 
-# list for wrong image sizes from flickr.photos.getSizes
-wsizes = ['_o.jpg', '_o.png', '_o.tif', '_m.jpg','_s.jpg','_q.jpg','_t.jpg','_n.jpg','_z.jpg','_c.jpg']
+# list of download jobs
+jobs = []
 
 # loop over parks and image urls
-print('[INFO] - Starting image download...')
-for park, imgurl in imglist:
+print('[INFO] - Preparing download jobs...')
+for park, imgurl, fname in imglist:
     
-    # generate random wait time to not get blocked by Flickr
-    randwait = round(random.uniform(0.9, 1.8),1)
+    # first 6 chars of park name
+    park = park[0:6]
     
-    # create directory structure and download images
-    try:
-        # first 6 chars of park name
-        park = park[0:6]
+    # skip images downloaded in previous runs
+    if fname in donelist:
+        continue
+    
+    # only record photos the image store already holds
+    if fname in heldlist:
+        sfname, spark, sha1, nbytes, spath = store.get(fname)
         
-        # create park specific directories
-        if not os.path.exists(args['outpath'] + park):
-            os.makedirs(args['outpath'] + park)
+        # resize and crop the stored image for this harvest
+        if args['resized'] is not None:
+            path = shard_dir(args['resized'], park, fname, args['fanout'])
+            os.makedirs(path, exist_ok=True)
+            try:
+                path, size, mtime = resize_file((spath, os.path.join(path, sfname), 900))
+            except OSError as e:
+                print('[INFO] - ' + str(e) + ' -- Could not resize stored image ' + fname)
+                continue
+            index.add(fname, park, sfname, path, size, mtime)
         
-        # extract original filename
-        fname = imgurl.split('/')[-1]
+        manifest.record(fname, imgurl, spath, 'done', nbytes=nbytes, sha1=sha1)
+        donelist.add(fname)
+        continue
+    
+    # add download job
+    jobs.append((imgurl, park, fname))
+
+# set up running progress indicator numbers
+i = 1
+imgcount = len(jobs)
+lost = 0
+print('[INFO] - ' + str(len(donelist)) + ' images already downloaded, skipping them')
+
+# rate limiter to not get blocked by Flickr
+limiter = HostRateLimiter(args['rate'], args['burst'])
+
+# keep-alive session retrying transient errors
+session = HTTPSession(timeout=args['timeout'], retries=args['retries'],
+                      limiter=limiter)
+
+# flickr sizes to try, from smallest sufficient to largest
+suffixes = size_suffixes(args['target_size'])
+print('[INFO] - Downloading image sizes ' + ', '.join(suffixes))
+
+# function to download a single image
+def fetch(job):
+    imgstem, park, pid = job
+    
+    # create park specific directories
+    parkdir = shard_dir(args['outpath'], park, pid, args['fanout'])
+    if store is None and (args['resized'] is None or args['keep_originals']):
+        os.makedirs(parkdir, exist_ok=True)
+    
+    # try sizes from smallest to largest
+    for n, suffix in enumerate(suffixes):
+        imgurl = imgstem + suffix + '.jpg'
+        fname = pid + suffix + '.jpg'
+        path = os.path.join(parkdir if store is None else store.tmpdir, fname)
+        last = n == len(suffixes) - 1
         
-        # set filenames to match 1024 x 768 size images
-        if any(imgsize in fname for imgsize in wsizes):
-            fname = fname[:-6] + '_b.jpg'
-        else:
-            fname = fname[:-4] + '_b.jpg'
+        try:
+            # stream image to park specific directory
+            if args['resized'] is None:
+                nbytes, sha1, latency = session.download(imgurl, path)
+                img = None
             
-        # set flickr image urls to download 1024 x 768 size images
-        if any(imgsize in imgurl for imgsize in wsizes):
-            imgurl = imgurl[:-6] + '_b.jpg'
-        else:
-            imgurl = imgurl[:-4] + '_b.jpg'
+            # or download image into memory for resizing
+            else:
+                data, sha1, latency = session.fetch(imgurl)
+                nbytes = len(data)
+                img = Image.open(io.BytesIO(data))
         
-        # download image to park specific directory
-        file = urllib.request.urlretrieve(imgurl, args['outpath'] + '{0}\{1}'.format(park,fname))
-        print('[INFO] - ' + str(i) + '/' + str(imgcount) +' image saved')
+        # fall back to a larger size if this one is missing
+        except urllib.error.HTTPError as e:
+            if e.code in (404, 410) and not last:
+                continue
+            raise
         
-        # sleep to not get disconnected by Flickr
-        time.sleep(randwait)
+        # fall back to a larger size if the image is too small
+        if args['target_size'] and not last:
+            if img is None:
+                with Image.open(path) as saved:
+                    size = saved.size
+            else:
+                size = img.size
+            if min(size) < args['target_size']:
+                if img is None:
+                    os.remove(path)
+                continue
         
-        # update progress indicator
-        i += 1
+        # move the downloaded image into the image store
+        if store is not None and img is None:
+            path = store.put(path, sha1)
         
-        # check if errors have occurred
-        if len(errorlist) > 0:
+        # resize and crop image in memory and save only the cropped image
+        if img is not None:
+            
+            # keep the downloaded image in the store or save it if requested
+            if store is not None:
+                store.put_bytes(data, sha1)
+            elif args['keep_originals']:
+                with open(path, 'wb') as f:
+                    f.write(data)
             
-            # log errors into txt file
-            with open(args['outpath'] + "flickr_errors.txt", "w") as output:
-                output.write(str(errorlist))
+            path = shard_dir(args['resized'], park, pid, args['fanout'])
+            os.makedirs(path, exist_ok=True)
+            path = os.path.join(path, fname)
+            resize_crop(img).save(path)
+        
+        return imgurl, fname, path, nbytes, sha1
+
+# download images concurrently
+print('[INFO] - Starting image download...')
+for (imgstem, park, pid), result in run_concurrently(fetch, jobs, args['workers']):
     
-    # catch errors and continue without waiting
-    except urllib.error.HTTPError as e:
+    # check download result
+    try:
+        imgurl, fname, path, nbytes, sha1 = result.result()
+        manifest.record(pid, imgurl, path, 'done', nbytes=nbytes, sha1=sha1)
+        
+        # add the image to the store
+        if store is not None:
+            store.record(pid, fname, park, sha1, nbytes)
+        
+        # add the image to the index
+        if index is not None:
+            st = os.stat(path)
+            index.add(pid, park, fname, path, st.st_size, st.st_mtime)
+        print('[INFO] - ' + str(i) + '/' + str(imgcount) +' image saved')
         
-        # save error type and file name
-        error_element = {"error": e, "file": fname}
+        # update progress indicator
+        i += 1
+    
+    # catch http errors, connection errors left after retries and broken
+    # images and continue
+    except OSError as e:
         
-        # append error to list
-        errorlist.append(error_element)
-        print('[INFO] - ' + str(e) + ' -- Total images lost: ' + str(len(errorlist)))
+        # save error type for the photo id
+        manifest.record(pid, imgstem, None, 'failed', error=str(e))
+        lost += 1
+        print('[INFO] - ' + str(e) + ' -- Total images lost: ' + str(lost))
         
         # update progress indicator
         i += 1
         continue
 
+# save remaining manifest and store rows
+manifest.commit()
+if store is not None:
+    store.close()
+if index is not None:
+    index.close()
+
 # inform about ending of downloads
 print('[INFO] - Available images downloaded!')
+print(session.summary())
 
 # create a list of photoids with error messages
-epl = []
+errorlist = manifest.errors()
+epl = [pid for pid, error in errorlist]
 
-# loop over errors
-print('[INFO] - Removing posts with errors in photo retrieval...')
-for error in errorlist:
-    
-    # get photo id of error file
-    photoid = error['file:'][:-6]
-    
-    # append error photo id to list
-    epl.append(photoid)
-    
-# create empty photoid list
-pidlist = []
-
-# loop over parks and urls
-for park, imgurl in imglist:
-    
-    # retrieve photo id
-    pid = imgurl.split('/')[-1]
-    
-    # format photo id
-    if any(imgsize in pid for imgsize in wsizes):
-        pid = pid[:-6]
-    else:
-        pid = pid[:-4]
-    
-    # append photo id to list
-    pidlist.append(pid)
-
-# create full photoid column
-df['pid'] = pidlist
+# log errors into txt file
+if len(errorlist) > 0:
+    with open(os.path.join(args['outpath'], "flickr_errors.txt"), "w") as output:
+        output.write(str(errorlist))
 
 # remove posts with missing photos
+print('[INFO] - Removing posts with errors in photo retrieval...')
 df = df[~df['pid'].isin(epl)]
 print('[INFO] - Posts with missing photos removed!')
 
 # save trimmed df to file
 print('[INFO] - Saving to geopackage...')
-df.to_file(outgp, driver='GPKG')
+write_gpkg(df, outgp)
+
+# close manifest
+manifest.close()
 
 print('[INFO] - ... done!')
\ No newline at end of file
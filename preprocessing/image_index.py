@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 13:35:52 2026
+
+INFORMATION
+===========
+
+This module contains the sharded directory layout and the image index used by
+image_download.py, resize_photos.py and the computer vision scripts.
+
+With a fan-out depth of two, the image of photo id 123_abc in Nuuksio is
+saved as
+
+    root/Nuuksi/9f/0c/123_abc_b.jpg
+
+where 9f and 0c are taken from the MD5 hash of the photo id. This keeps every
+directory small no matter how many images there are. A fan-out depth of zero
+gives the old flat layout root/Nuuksi/123_abc_b.jpg.
+
+Every stage writing images records them in an SQLite index at
+root/index.sqlite, so stages reading images do not have to list directories.
+Directories written by other means can be indexed with ImageIndex.scan(),
+which walks the tree with os.scandir and remembers the modification time of
+every directory. Later scans only list the directories whose modification
+time has changed, i.e. where images have been added or removed.
+
+validate_images.py decodes every indexed image and records its width, height,
+color mode and whether it could be decoded. Images that failed validation are
+left out of ImageIndex.images() and list_images(), so later stages never read
+them.
+
+"""
+
+from imutils import paths
+from flickr_ids import pid_from_filename
+from PIL import Image
+import hashlib
+import sqlite3
+import os
+
+
+# file name of the index in an image root directory
+INDEX_NAME = 'index.sqlite'
+
+# file extensions recorded by scans
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png')
+
+# exceptions of decoding a broken image, treated as invalid by
+# validate_images.py and skipped by the computer vision scripts
+IMAGE_ERRORS = (OSError, SyntaxError, ValueError, Image.DecompressionBombError)
+
+# columns written by validate_images.py
+VALIDATION_COLUMNS = [('width', 'INTEGER'), ('height', 'INTEGER'),
+                      ('mode', 'TEXT'), ('valid', 'INTEGER')]
+
+# insert or update an image, keeping the validation result if the file has
+# the same size and modification time
+UPSERT_IMAGE = ('INSERT INTO images (pid, park, fname, path, dir, size, mtime) '
+                'VALUES (?,?,?,?,?,?,?) ON CONFLICT (pid) DO UPDATE SET '
+                'park = excluded.park, fname = excluded.fname, path = excluded.path, '
+                'dir = excluded.dir, size = excluded.size, mtime = excluded.mtime, '
+                'valid = CASE WHEN images.size IS excluded.size AND '
+                'images.mtime IS excluded.mtime THEN images.valid END')
+
+
+def shard_dir(root, park, pid, depth=2, width=2):
+    """Return directory of a photo id in the hashed fan-out layout."""
+    digest = hashlib.md5(pid.encode('utf-8')).hexdigest()
+    shards = [digest[i * width:(i + 1) * width] for i in range(depth)]
+    return os.path.join(root, park, *shards)
+
+
+def park_of(root, path):
+    """Return the park directory of an image path below root."""
+    return os.path.relpath(path, root).split(os.path.sep)[0]
+
+
+class ImageIndex:
+    """SQLite index of the images below an image root directory."""
+
+    def __init__(self, root, commit_every=500):
+        self.root = root
+        self.commit_every = commit_every
+        self.uncommitted = 0
+        os.makedirs(root, exist_ok=True)
+
+        # open image table
+        self.conn = sqlite3.connect(os.path.join(root, INDEX_NAME))
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS images (
+                                 pid TEXT PRIMARY KEY,
+                                 park TEXT,
+                                 fname TEXT,
+                                 path TEXT,
+                                 dir TEXT,
+                                 size INTEGER,
+                                 mtime REAL)''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS images_dir ON images (dir)')
+
+        # add validation columns, also to indexes written by earlier versions
+        cols = set(row[1] for row in self.conn.execute('PRAGMA table_info(images)'))
+        for name, coltype in VALIDATION_COLUMNS:
+            if name not in cols:
+                self.conn.execute('ALTER TABLE images ADD COLUMN {} {}'.format(name, coltype))
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS dirs (
+                                 dir TEXT PRIMARY KEY,
+                                 parent TEXT,
+                                 mtime REAL)''')
+        self.conn.commit()
+
+    @staticmethod
+    def exists(root):
+        """Check whether an image root directory has an index."""
+        return os.path.exists(os.path.join(root, INDEX_NAME))
+
+    def add(self, pid, park, fname, path, size=None, mtime=None):
+        """Record an image. Path may be absolute or relative to the current
+        directory, and is stored relative to the root."""
+        path = os.path.relpath(os.path.abspath(path), os.path.abspath(self.root))
+        self.conn.execute(UPSERT_IMAGE, (pid, park, fname, path, os.path.dirname(path),
+                                         size, mtime))
+
+        # commit in batches to keep the number of disk syncs low
+        self.uncommitted += 1
+        if self.uncommitted >= self.commit_every:
+            self.commit()
+
+    def remove(self, pid):
+        """Forget an image."""
+        self.conn.execute('DELETE FROM images WHERE pid = ?', (pid,))
+
+    def set_valid(self, pid, width, height, mode, valid):
+        """Record the validation result of an image."""
+        self.conn.execute('UPDATE images SET width = ?, height = ?, mode = ?, valid = ? '
+                          'WHERE pid = ?', (width, height, mode, int(valid), pid))
+
+        # commit in batches to keep the number of disk syncs low
+        self.uncommitted += 1
+        if self.uncommitted >= self.commit_every:
+            self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self.uncommitted = 0
+
+    def images(self):
+        """List of (pid, park, fname, path) tuples of indexed images, leaving
+        out images that failed validation."""
+        rows = self.conn.execute('SELECT pid, park, fname, path FROM images '
+                                 'WHERE valid IS NOT 0 ORDER BY pid')
+        return [(pid, park, fname, os.path.join(self.root, path))
+                for pid, park, fname, path in rows]
+
+    def unvalidated(self, revalidate=False):
+        """List of (pid, path) tuples of images not validated yet, or of all
+        images if revalidate is set."""
+        rows = self.conn.execute('SELECT pid, path FROM images {}ORDER BY pid'
+                                 .format('' if revalidate else 'WHERE valid IS NULL '))
+        return [(pid, os.path.join(self.root, path)) for pid, path in rows]
+
+    def pids(self):
+        """Set of indexed photo ids."""
+        return set(row[0] for row in self.conn.execute('SELECT pid FROM images'))
+
+    def scan(self):
+        """Bring the index up to date with the directory tree.
+
+        Only directories whose modification time differs from the previous
+        scan are listed. Returns the number of directories listed.
+        """
+        # directory modification times and subdirectories of previous scan
+        known = {}
+        children = {}
+        for d, parent, mtime in self.conn.execute('SELECT * FROM dirs'):
+            known[d] = mtime
+            children.setdefault(parent, []).append(d)
+
+        # walk the tree starting from the root
+        seen = set()
+        listed = 0
+        stack = ['']
+        while stack:
+            d = stack.pop()
+            try:
+                mtime = os.stat(os.path.join(self.root, d)).st_mtime
+            except FileNotFoundError:
+                continue
+            seen.add(d)
+
+            # skip listing unchanged directories but visit their subdirectories
+            if known.get(d) == mtime:
+                stack.extend(children.get(d, []))
+                continue
+
+            # list the changed directory
+            listed += 1
+            rows = []
+            with os.scandir(os.path.join(self.root, d)) as entries:
+                for entry in entries:
+                    rel = os.path.join(d, entry.name)
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(rel)
+                    elif entry.name.lower().endswith(IMAGE_EXTS):
+                        st = entry.stat()
+                        park = rel.split(os.path.sep)[0]
+                        rows.append((pid_from_filename(entry.name), park, entry.name, rel, d,
+                                     st.st_size, st.st_mtime))
+
+            # replace the images of the directory
+            found = set(row[0] for row in rows)
+            gone = [(pid,) for (pid,) in self.conn.execute(
+                'SELECT pid FROM images WHERE dir = ?', (d,)) if pid not in found]
+            self.conn.executemany('DELETE FROM images WHERE pid = ?', gone)
+            self.conn.executemany(UPSERT_IMAGE, rows)
+            self.conn.execute('INSERT OR REPLACE INTO dirs VALUES (?,?,?)',
+                              (d, os.path.dirname(d) if d else None, mtime))
+
+        # forget directories that have been removed
+        for d in set(known) - seen:
+            self.conn.execute('DELETE FROM images WHERE dir = ?', (d,))
+            self.conn.execute('DELETE FROM dirs WHERE dir = ?', (d,))
+        self.commit()
+
+        return listed
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+
+def list_images(root):
+    """Return image paths below root from its index, or by walking the
+    directories if there is no index."""
+    if ImageIndex.exists(root):
+        return [path for pid, park, fname, path in ImageIndex(root).images()]
+    return list(paths.list_images(root))
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 19:12:40 2026
+
+INFORMATION
+===========
+
+This module contains packed arrays of resized images, written by
+resize_photos.py --pack and read by the computer vision scripts. Instead of
+one JPEG file per photo, every resizing profile is saved as one uint8 array of
+shape (images, size, size, 3) in a .npy file, and a csv file maps photo ids to
+rows of the array:
+
+    output/224px/images.npy
+    output/224px/images.csv
+
+Reading the array as a memory map avoids opening and decoding hundreds of
+thousands of small files. Consecutive rows are read sequentially from disk and
+slices of the memory map are views, so batches are not copied before the
+model preprocessing.
+
+"""
+
+from resize_utils import resize_profiles
+from PIL import Image
+import pandas as pd
+import numpy as np
+import os
+
+
+# file names of the packed array and its index in a profile directory
+PACK_NAME = 'images.npy'
+PACK_INDEX = 'images.csv'
+
+# packed arrays opened by the current worker process
+_packs = {}
+
+
+def create_pack(root, rows, size):
+    """Allocate a packed array for rows of (pid, park, fname) tuples and write
+    its index. Returns the path of the array."""
+    os.makedirs(root, exist_ok=True)
+    index = pd.DataFrame(rows, columns=['photoid', 'park', 'filename'])
+    index['row'] = range(len(index))
+    index.to_csv(os.path.join(root, PACK_INDEX), index=False)
+
+    # allocate the array on disk without holding it in memory
+    path = os.path.join(root, PACK_NAME)
+    pack = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8,
+                                     shape=(len(index), size, size, 3))
+    del pack
+    return path
+
+
+def pack_file_profiles(job):
+    """Resize the image file src to every profile and write it into the
+    packed arrays. dsts is a dict of profile sizes and (array path, row)
+    tuples. Meant to be run in worker processes. Returns list of the rows
+    written in the order of dsts."""
+    src, dsts = job
+    with Image.open(src) as img:
+        resized = resize_profiles(img, list(dsts))
+    results = []
+    for size, (path, row) in dsts.items():
+        if path not in _packs:
+            _packs[path] = np.load(path, mmap_mode='r+')
+        _packs[path][row] = np.asarray(resized[size].convert('RGB'))
+        results.append(row)
+    return results
+
+
+class PackReader:
+    """Read only access to a packed array of resized images."""
+
+    def __init__(self, root):
+        self.root = root
+        self.index = pd.read_csv(os.path.join(root, PACK_INDEX))
+        self.images = np.load(os.path.join(root, PACK_NAME), mmap_mode='r')
+        self.rows = pd.Series(self.index['row'].values, index=self.index['photoid'])
+
+    @staticmethod
+    def exists(root):
+        """Check whether a directory has a packed array."""
+        return os.path.exists(os.path.join(root, PACK_NAME))
+
+    def __len__(self):
+        return len(self.index)
+
+    def paths(self):
+        """Image paths of the packed images as they would be saved as files,
+        for keeping file names and photo ids in the output dataframes."""
+        return [os.path.join(self.root, park, fname) for park, fname
+                in zip(self.index['park'], self.index['filename'])]
+
+    def batch(self, start, stop):
+        """Images of consecutive rows as a view of the memory map."""
+        return self.images[start:stop]
+
+    def has(self, pids):
+        """Boolean array telling which of the photo ids are in the pack."""
+        return np.isin(np.asarray(pids), self.index['photoid'].values)
+
+    def take(self, pids):
+        """Images of a list of photo ids, skipping photo ids not in the pack."""
+        pids = np.asarray(pids)
+        return self.images[self.rows[pids[self.has(pids)]].values]
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 12:41:09 2026
+
+INFORMATION
+===========
+
+This module contains a content-addressed image store shared by all harvests.
+Images are saved under the SHA-1 hash of their content and a SQLite table
+maps every photo id to its hash, file name and park. A photo already in the
+store is never downloaded again, so re-harvesting only updates metadata, and
+identical images saved under different photo ids take disk space only once.
+
+The store directory looks like this:
+
+    store/
+        store.sqlite
+        objects/3f/a2/3fa2...c1.jpg
+        tmp/
+
+Database writes should happen in one thread only. Worker threads can call
+put() to move finished downloads into the store and let the main thread
+record() them.
+
+"""
+
+import tempfile
+import sqlite3
+import time
+import os
+
+
+class ImageStore:
+    """Content-addressed store of downloaded Flickr images."""
+
+    def __init__(self, root, commit_every=50):
+        self.root = root
+        self.commit_every = commit_every
+        self.uncommitted = 0
+        self.tmpdir = os.path.join(root, 'tmp')
+        os.makedirs(self.tmpdir, exist_ok=True)
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+
+        # open photo id table
+        self.conn = sqlite3.connect(os.path.join(root, 'store.sqlite'))
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS images (
+                                 pid TEXT PRIMARY KEY,
+                                 fname TEXT,
+                                 park TEXT,
+                                 sha1 TEXT,
+                                 bytes INTEGER,
+                                 added REAL)''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS images_sha1 ON images (sha1)')
+        self.conn.commit()
+
+    def object_path(self, sha1):
+        """Path of the image with the given content hash."""
+        return os.path.join(self.root, 'objects', sha1[0:2], sha1[2:4], sha1 + '.jpg')
+
+    def put(self, src, sha1):
+        """Move the file src into the store and return its store path. If the
+        content is already stored the file is simply removed."""
+        dst = self.object_path(sha1)
+        if os.path.exists(dst):
+            os.remove(src)
+        else:
+            # replacing is atomic, so a thread storing the same content at the
+            # same time only replaces it with an identical complete file
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            os.replace(src, dst)
+        return dst
+
+    def put_bytes(self, data, sha1):
+        """Write image bytes into the store and return the store path."""
+        dst = self.object_path(sha1)
+        if not os.path.exists(dst):
+            
+            # unique temporary file, as threads may write the same content
+            fd, tmp = tempfile.mkstemp(suffix='.part', dir=self.tmpdir)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            self.put(tmp, sha1)
+        return dst
+
+    def record(self, pid, fname, park, sha1, nbytes):
+        """Map a photo id to stored content."""
+        self.conn.execute('INSERT OR REPLACE INTO images VALUES (?,?,?,?,?,?)',
+                          (pid, fname, park, sha1, nbytes, time.time()))
+
+        # commit in batches to keep the number of disk syncs low
+        self.uncommitted += 1
+        if self.uncommitted >= self.commit_every:
+            self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self.uncommitted = 0
+
+    def held(self):
+        """Photo ids with an image in the store."""
+        return set(row[0] for row in self.conn.execute('SELECT pid FROM images'))
+
+    def get(self, pid):
+        """Return (fname, park, sha1, bytes, path) of a photo id or None."""
+        row = self.conn.execute('SELECT fname, park, sha1, bytes FROM images '
+                                'WHERE pid = ?', (pid,)).fetchone()
+        if row is None:
+            return None
+        return row + (self.object_path(row[2]),)
+
+    def images(self):
+        """List of (pid, fname, park, path) tuples of all stored images."""
+        rows = self.conn.execute('SELECT pid, fname, park, sha1 FROM images '
+                                 'ORDER BY pid')
+        return [(pid, fname, park, self.object_path(sha1))
+                for pid, fname, park, sha1 in rows]
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
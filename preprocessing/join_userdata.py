@@ -21,11 +21,26 @@ User data file:
     locality
     datetimes
 
+Park table (default preprocessing/park_regions.csv):
+    park names
+    landscape regions
+
+The input can also be a feature store directory written by extract_features.py
+--featurestore, of which only the slim metadata is read. The output then keeps
+the feature matrix rows instead of the features, ready for reduce_dimensions.py
+--featurestore.
+
 USAGE
 =====
 Run script in terminal/command prompt:
     python join_userdata.py -i features.pkl -ud users.gpkg -o output.pkl
 
+Join user data to the metadata of a feature store by typing:
+    python join_userdata.py -i features/ -ud users.gpkg -o output.pkl
+
+Classify parks into landscape regions with another park table by typing:
+    python join_userdata.py -i features.pkl -ud users.gpkg -o output.pkl -pr regions.csv
+
 @author: tuomvais
 """
 
@@ -33,31 +48,51 @@ from __future__ import print_function
 import time
 import numpy as np
 import pandas as pd
-import geopandas as gpd
 import argparse
+import os
+import sys
+
+# make the shared modules of the preprocessing scripts importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, 'preprocessing'))
+from gpkg_io import read_gpkg
+from feature_store import FeatureStore
 
 # define arguments
 ap = argparse.ArgumentParser()
 ap.add_argument('-i','--input',required=True,
-                help='path to input feature vector dataset')
+                help='path to input feature vector dataset or feature store directory')
 ap.add_argument('-ud','--userdata',required=True,
                 help='path to user dataset geopackage')
 ap.add_argument('-o','--output', default='/plot_outputs/',
                 help='output directory for pickle')
+ap.add_argument('-pr','--parkregions',
+                default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                     os.pardir, 'preprocessing', 'park_regions.csv'),
+                help='path to csv file of park names and landscape regions')
 args = vars(ap.parse_args())
 
-# load pickle with extracted features in
-print('[INFO] - Reading pickle in...')
-df = pd.read_pickle(args['input'])
+# load metadata of feature store, leaving the features on disk
+if FeatureStore.exists(args['input']):
+    print('[INFO] - Reading feature store metadata in...')
+    df = FeatureStore(args['input']).meta
+
+# or load pickle with extracted features in
+else:
+    print('[INFO] - Reading pickle in...')
+    df = pd.read_pickle(args['input'])
+
+# get wanted user data columns
+usercols = ['date_taken','pid','user_id', 'country','gender','Local','Nimi']
 
 # load user data in
 print('[INFO] - Reading geopackage in...')
-userdf = gpd.read_file(args['userdata'])
+userdf = read_gpkg(args['userdata'], columns=usercols)
 
 # create columns for datetimes and seasons
 print('[INFO] - Preparing user data for joining...')
 userdf['date'] = pd.to_datetime(userdf['date_taken'], errors='coerce')
-userdf['season'] = userdf['date'].apply(lambda dt: (dt.month%12 + 3)//3)
+userdf['season'] = (userdf['date'].dt.month % 12 + 3) // 3
 
 # get wanted user data columns
 usercols = ['date', 'season','pid','user_id', 'country','gender','Local','Nimi']
@@ -72,34 +107,25 @@ userdf = userdf.rename(columns={'Local':'local','Nimi':'parkname'})
 locdict = {1:'National', 0:'International'}
 seadict = {1:'Winter',2:'Spring',3:'Summer',4:'Autumn'}
 
-# insert strings to user dataframe for better legibility
-for i, row in userdf.iterrows():
-    userdf.at[i, 'locstr'] = locdict[row['local']]
-    userdf.at[i, 'seastr'] = seadict[row['season']]
+# insert strings to user dataframe for better legibility, kept as plain
+# strings so that groupbys of the stats and plot scripts see only observed
+# values
+userdf['locstr'] = userdf['local'].map(locdict)
+userdf['seastr'] = userdf['season'].map(seadict)
+
+# read landscape regions of parks
+regions = pd.read_csv(args['parkregions'])
+
+# classify posts into landscape regions
+userdf['landscape_region'] = userdf['parkname'].map(
+    regions.set_index('parkname')['landscape_region'])
 
-# merge feature and user dataframes
+# merge feature and user dataframes, all user data columns are ready so the
+# wide feature dataframe is copied only once
 print('[INFO] - Joining the dataframes...')
 df = df.merge(userdf, left_on='photoid', right_on='pid')
 print('[INFO] - Join complete! Size of the dataframe: {}'.format(df.shape))
 
-# list parks in 4 landscape regions
-laplist = ['Urho Kekkosen kansallispuisto', 'Pallas-Yllästunturin kansallispuisto', 'Pyhä-Luoston kansallispuisto']
-eastlist = ['Oulangan kansallispuisto','Kolin kansallispuisto','Syötteen kansallispuisto','Hossan kansallispuisto', 'Riisitunturin kansallispuisto']
-southlist = ['Nuuksion kansallispuisto', 'Sipoonkorven kansallispuisto', 'Helvetinjärven kansallispuisto','Seitsemisen kansallispuisto',
-             'Repoveden kansallispuisto','Teijon kansallispuisto','Leivonmäen kansallispuisto','Hossan kansallispuisto','Liesjärven kansallispuisto']
-archilist = ['Saaristomeren kansallispuisto','Selkämeren kansallispuisto','Tammisaaren saariston kansallispuisto']
-
-# classify posts into landscape regions
-for i, row in df.iterrows():
-    if row['parkname'] in laplist:
-        df.at[i, 'landscape_region'] = 'Lapland fells'
-    elif row['parkname'] in eastlist:
-        df.at[i, 'landscape_region'] = 'Eastern hills'
-    elif row['parkname'] in southlist:
-        df.at[i, 'landscape_region'] = 'Forests & lakes'
-    elif row['parkname'] in archilist:
-        df.at[i, 'landscape_region'] = 'Archipelago'
-
 # save output
 print('[INFO] - Saving results to pickle...')
 df.to_pickle(args['output'])
@@ -8,6 +8,11 @@ INFORMATION
 This script checks which images were succesfully retrieved from Flickr and
 saves a geopackage that reflects the succesful retrievals.
 
+The retrieved images are looked up from the index file (index.sqlite) of the
+image directory. The index is brought up to date on every run, but only
+directories changed since the previous run are listed again, so re-checking a
+large image directory is fast.
+
 
 USAGE
 =====
@@ -15,13 +20,19 @@ Run the script by running the following command:
     
     python3 photoid_match.py -i yourdata.gpkg -o output/directory/ -gp yourdata2.gpkg
 
+To check against a shared image store (see image_download.py), run:
+    
+    python3 photoid_match.py -i yourdata.gpkg -st path/to/store -gp yourdata2.gpkg
+
 
 @author: tuomvais
 """
 
-import glob
-import geopandas as gpd
 import argparse
+from image_store import ImageStore
+from image_index import ImageIndex
+from flickr_ids import pid_from_url
+from gpkg_io import read_gpkg, write_gpkg
 
 
 # Set up the argument parser
@@ -32,9 +43,13 @@ ap.add_argument("-i", "--input", required=True,
                 help="Path to geopackage file")
 
 # Define the path to output directory
-ap.add_argument("-img", "--imgpath", required=True,
+ap.add_argument("-img", "--imgpath",
                 help="Path to image root directory.")
 
+# Define the path to image store
+ap.add_argument("-st", "--store",
+                help="Path to image store to check instead of image directory.")
+
 # Define the preprocessing strategy
 ap.add_argument("-gp", "--geopackage", required=True,
                 help="Name of the geopackage file to be saved")
@@ -44,42 +59,33 @@ args = vars(ap.parse_args())
 
 imgpath = args['imgpath']
 
-# retrieve image paths to list
-print('[INFO] - Retrieving all images in directory structure...')
-imgfiles = glob.glob(imgpath + '\*\*.jpg')
-
-# list of retrieved photoids
-retphotos = []
-
-# retrieve returned photoids
-for imgpath in imgfiles:
-    pid = imgpath.split('\\')[-1]
-    pid = pid[:-6]
-    retphotos.append(pid)
+# check that images are given
+if imgpath is None and args['store'] is None:
+    ap.error('either --imgpath or --store is required')
+
+# retrieve photoids held in image store
+if args['store'] is not None:
+    print('[INFO] - Retrieving all images in image store...')
+    retphotos = ImageStore(args['store']).held()
+
+else:
+    # update image index with changed directories
+    print('[INFO] - Updating image index of directory structure...')
+    index = ImageIndex(imgpath)
+    listed = index.scan()
+    print('[INFO] - ' + str(listed) + ' changed directories listed')
+    
+    # retrieve returned photoids
+    retphotos = index.pids()
+    index.close()
 
 # read posts dataframe in
 print('[INFO] - Reading geopackage in...')
-df = gpd.read_file(args['input'])
-
-# list for wrong image sizes
-wsizes = ['_o.jpg', '_o.png', '_o.tif', '_m.jpg','_s.jpg','_q.jpg','_t.jpg','_n.jpg','_z.jpg','_c.jpg']
-
-# empty list for all photo ids of downloaded images
-pidlist = []
+df = read_gpkg(args['input'])
 
-# loop over dataframe
-print('[INFO] - Fetching photo ids')
-for i, row in df.iterrows():
-    pid = row['photo_url'].split('/')[-1]
-    if any(imgsize in pid for imgsize in wsizes):
-        pid = pid[:-6]
-        pidlist.append(pid)
-    else:
-        pid = pid[:-4]
-        pidlist.append(pid)
-    
 # create full photoid column
-df['pid'] = pidlist
+print('[INFO] - Fetching photo ids')
+df['pid'] = pid_from_url(df['photo_url'])
 
 # remove posts with missing photos
 print('[INFO] - Dropping images not present in the directories..')
@@ -87,6 +93,6 @@ df = df[df['pid'].isin(retphotos)]
 
 # save trimmed df to file
 print('[INFO] - Saving to geopackage...')
-df.to_file(args['geopackage'], driver='GPKG')
+write_gpkg(df, args['geopackage'])
 
 print('[INFO] - ... done!')
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 00:58:31 2026
+
+INFORMATION
+===========
+This script runs a stage as a worker of a file-based work queue (see
+work_queue.py), so that several machines sharing a filesystem can split the
+work of one stage between them. Start the same worker command on every
+machine. Each worker claims shards from the queue directory one at a time and
+runs the stage command on them, replacing {shard} in the command with the
+shard number. Shards of workers that died are re-queued automatically.
+
+When all shards are done, the same script merges the shard outputs. Pickled
+dataframes are concatenated in photo id order, feature stores are merged into
+one and image directories are indexed.
+
+USAGE
+=====
+Detect objects in 64 shards by running the following command on every
+machine:
+
+    python3 queue_worker.py -q /shared/queue -n 64 -- python3 cv/detect_objects.py -w mask_rcnn_coco.h5 -l labels.txt -i input.pkl -o /shared/out/detect_{shard}.pkl -cp /shared/checkpoint/{shard} -sd {shard}/64
+
+The checkpoint directory per shard lets a re-queued shard continue where the
+dead worker left off. Then merge the shard outputs by running:
+
+    python3 queue_worker.py -q /shared/queue -n 64 -m -pp /shared/out/detect_{shard}.pkl -o output.pkl
+
+Merge the feature stores of extract_features.py by adding e.g.
+-fs /shared/features_{shard} -fo features/ to the merge command instead of -pp.
+The merged metadata is then saved as the output pickle. Resize photos in shards
+with resize_photos.py -sd {shard}/64 and index the output directories of the
+resizing profiles when merging by running:
+
+    python3 queue_worker.py -q /shared/queue -n 64 -m -img output/directory/224px output/directory/512px
+
+"""
+
+from work_queue import WorkQueue, merge_pickles
+from feature_store import merge_stores
+from image_index import ImageIndex
+import subprocess
+import argparse
+import time
+import sys
+
+# define arguments
+ap = argparse.ArgumentParser()
+ap.add_argument('-q','--queue', required=True,
+                help='path to queue directory on a shared filesystem')
+ap.add_argument('-n','--shards', type=int, required=True,
+                help='number of shards')
+ap.add_argument('-to','--timeout', type=int, default=600,
+                help='seconds after which a claim without heartbeat is re-queued, '
+                'default 600')
+ap.add_argument('-hb','--heartbeat', type=int, default=60,
+                help='seconds between heartbeats of claimed shards, default 60')
+ap.add_argument('-m','--merge', action='store_true',
+                help='merge the outputs of all shards instead of running a worker')
+ap.add_argument('-pp','--partpath',
+                help='path of pickled shard outputs with {shard} in place of the '
+                'shard number, for merging')
+ap.add_argument('-o','--output',
+                help='path to merged output pickle')
+ap.add_argument('-fs','--featurestore',
+                help='path of shard feature stores with {shard} in place of the '
+                'shard number, for merging')
+ap.add_argument('-fo','--featureoutput',
+                help='path to merged feature store')
+ap.add_argument('-img','--imgpath', nargs='+',
+                help='paths to image directories written in shards to index when '
+                'merging, e.g. one per resizing profile')
+ap.add_argument('command', nargs=argparse.REMAINDER,
+                help='stage command to run on every shard, after --')
+args = vars(ap.parse_args())
+
+# open work queue
+queue = WorkQueue(args['queue'], args['shards'], args['timeout'], args['heartbeat'])
+
+# merge shard outputs after checking that all shards are done
+if args['merge']:
+    missing = queue.missing()
+    if missing:
+        sys.exit('[ERROR] - Shards not done yet: ' + ', '.join(str(k) for k in missing))
+
+    # merge feature stores, their metadata pointing to the merged rows
+    if args['featurestore'] is not None:
+        print('[INFO] - Merging feature stores of ' + str(args['shards']) + ' shards...')
+        df = merge_stores([args['featurestore'].replace('{shard}', str(k))
+                           for k in range(args['shards'])], args['featureoutput'])
+        if args['output'] is not None:
+            df.to_pickle(args['output'])
+        print('[INFO] - Merged ' + str(len(df)) + ' photos')
+
+    # or merge pickled dataframes in photo id order
+    elif args['partpath'] is not None:
+        print('[INFO] - Merging pickles of ' + str(args['shards']) + ' shards...')
+        df = merge_pickles([args['partpath'].replace('{shard}', str(k))
+                            for k in range(args['shards'])])
+        df.to_pickle(args['output'])
+        print('[INFO] - Merged ' + str(len(df)) + ' photos')
+
+    # index images written by all shards
+    for imgpath in args['imgpath'] or []:
+        print('[INFO] - Indexing image directory ' + imgpath + '...')
+        index = ImageIndex(imgpath)
+        index.scan()
+        index.close()
+
+    print('[INFO] - ... done!')
+    sys.exit()
+
+# drop the separator of the stage command
+command = args['command'][1:] if args['command'][:1] == ['--'] else args['command']
+if not command:
+    ap.error('a stage command is required unless merging')
+
+# shards whose command failed on this worker
+failed = set()
+
+# claim and process shards until all are done
+while True:
+    k = queue.claim(skip=failed)
+
+    # wait for shards claimed by other workers in case they die
+    if k is None:
+        if queue.pending():
+            time.sleep(args['heartbeat'])
+            continue
+        break
+
+    # run stage command on shard
+    print('[INFO] - Processing shard ' + str(k) + '/' + str(args['shards']) + '...')
+    proc = subprocess.Popen([a.replace('{shard}', str(k)) for a in command])
+
+    # stop the command if another worker took the shard over
+    while proc.poll() is None:
+        if queue.lost.wait(1):
+            proc.terminate()
+            proc.wait()
+    code = proc.returncode
+
+    # leave a shard taken over by another worker to it
+    if queue.lost.is_set():
+        print('[INFO] - Lost claim of shard ' + str(k) + ' to another worker')
+        queue.release()
+
+    # mark shard done, or put it back for other workers
+    elif code == 0:
+        if not queue.complete():
+            print('[INFO] - Lost claim of shard ' + str(k) + ' to another worker')
+    else:
+        print('[INFO] - Shard ' + str(k) + ' failed with exit code ' + str(code))
+        failed.add(k)
+        queue.release()
+
+# report shards left for other workers
+if failed:
+    print('[INFO] - Shards failed on this worker: ' + ', '.join(str(k) for k in sorted(failed)))
+print('[INFO] - ... done!')
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 19:58:14 2026
+
+INFORMATION
+===========
+
+This module contains the resize manifest used by the incremental mode of
+resize_photos.py. The manifest is a SQLite database in the output directory
+with one row per photo id and resizing profile, recording the byte size and
+modification time of the source image and the path of the resized image
+relative to the output directory, so runs from any working directory agree.
+
+When resize_photos.py is run again, images whose source size and modification
+time match the manifest and whose resized image still exists are skipped.
+Resized images of photo ids no longer in the input are removed.
+
+"""
+
+import sqlite3
+import os
+
+
+# file name of the manifest in an output directory
+MANIFEST_NAME = 'resize_manifest.sqlite'
+
+
+class ResizeManifest:
+    """SQLite backed record of resized images and their sources."""
+
+    def __init__(self, path, commit_every=500):
+        self.root = os.path.dirname(os.path.abspath(path))
+        self.conn = sqlite3.connect(path)
+        self.commit_every = commit_every
+        self.uncommitted = 0
+
+        # write-ahead log keeps the database consistent if the run is killed
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS resized (
+                                 pid TEXT,
+                                 profile INTEGER,
+                                 size INTEGER,
+                                 mtime REAL,
+                                 path TEXT,
+                                 PRIMARY KEY (pid, profile))''')
+        self.conn.commit()
+
+    def sources(self):
+        """Dict of (photo id, profile) keys and (source size, source
+        modification time, absolute resized path) values."""
+        rows = self.conn.execute('SELECT pid, profile, size, mtime, path FROM resized')
+        return dict(((pid, profile), (size, mtime, os.path.join(self.root, path)))
+                    for pid, profile, size, mtime, path in rows)
+
+    def record(self, pid, profile, size, mtime, path):
+        """Insert or replace the row of a resized image. Path may be absolute
+        or relative to the current directory, and is stored relative to the
+        output directory."""
+        path = os.path.relpath(os.path.abspath(path), self.root)
+        self.conn.execute('INSERT OR REPLACE INTO resized VALUES (?,?,?,?,?)',
+                          (pid, profile, size, mtime, path))
+
+        # commit in batches to keep the number of disk syncs low
+        self.uncommitted += 1
+        if self.uncommitted >= self.commit_every:
+            self.commit()
+
+    def remove(self, pid, profile):
+        """Forget a resized image."""
+        self.conn.execute('DELETE FROM resized WHERE pid = ? AND profile = ?',
+                          (pid, profile))
+
+    def commit(self):
+        self.conn.commit()
+        self.uncommitted = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
@@ -8,105 +8,259 @@ This script resizes the downloaded Flickr images and center crops them for
 computer vision models. It returns an output directory structure and places
 the center-cropped and resized images therein.
 
+Images are resized in parallel on all cores. JPEG images are downscaled while
+decoding and only the centered square is resampled.
+
 USAGE
 =====
 Run the script by running the following command:
     
     python3 resize_photos.py -i path/to/image/directory -o output/directory
 
+If the input directory has an index file written by image_download.py, the
+image paths are read from it instead of listing the directories. The resized
+images are recorded in an index file in the output directory.
+
+Spread the resized images over hashed subdirectories by running:
+    
+    python3 resize_photos.py -i path/to/image/directory -o output/directory -fo 2
+
+Resize the images of a shared image store (see image_download.py) by running:
+    
+    python3 resize_photos.py -st path/to/store -o output/directory
+
+Produce the exact input sizes of the computer vision models from a single
+decode of every image by running:
+    
+    python3 resize_photos.py -i path/to/image/directory -o output/directory -p 224 512
+
+This saves 224 x 224 images for ResNeXt101 and VGG16-Places365 in
+output/directory/224px and 512 x 512 images for Mask r-CNN in
+output/directory/512px, each with its own index file. The computer vision
+scripts read the variant matching their model automatically.
+
+Pack the resized images of every profile into one array file instead of
+separate image files by running:
+    
+    python3 resize_photos.py -i path/to/image/directory -o output/directory -p 224 512 -pk
+
+The computer vision scripts read packed arrays with the --pack option.
+
+Resize only new and changed images of a previous run by running:
+    
+    python3 resize_photos.py -i path/to/image/directory -o output/directory -in
+
+Source image sizes and modification times are recorded in a manifest in the
+output directory. Images whose source has not changed are skipped, and resized
+images whose source is gone are removed.
+
+Resize one shard of the images on each of several machines by running e.g.
+queue_worker.py with:
+    
+    python3 resize_photos.py -i path/to/image/directory -o output/directory -p 224 512 -sd {shard}/64
+
+Shards do not write index files. Index the output directories when merging
+the shards with queue_worker.py --merge --imgpath.
+
 
 @author: tuomvais
 """
 
-from PIL import Image
+from concurrent.futures import ProcessPoolExecutor
 from imutils import paths
+from resize_utils import resize_file, resize_file_profiles, profile_root
+from image_store import ImageStore
+from image_index import ImageIndex, shard_dir, park_of
+from image_pack import create_pack, pack_file_profiles
+from resize_manifest import ResizeManifest, MANIFEST_NAME
+from flickr_ids import pid_from_filename
+from work_queue import take_shard
 import os
-import numpy as np
 import argparse 
 
-# define arguments
-ap = argparse.ArgumentParser()
-ap.add_argument('-i','--input',required=True,
-                help='path to input image directory')
-ap.add_argument('-o','--output',required=True,
-                help='path to output resized image directory')
-args = vars(ap.parse_args())
+# run only in the main process, not in the worker processes
+if __name__ == '__main__':
+    
+    # define arguments
+    ap = argparse.ArgumentParser()
+    ap.add_argument('-i','--input',
+                    help='path to input image directory')
+    ap.add_argument('-st','--store',
+                    help='path to image store to read images from instead of --input')
+    ap.add_argument('-o','--output',required=True,
+                    help='path to output resized image directory')
+    ap.add_argument('-fo','--fanout', type=int, default=0,
+                    help='levels of hashed subdirectories per park in output, default 0')
+    ap.add_argument('-w','--workers', type=int, default=os.cpu_count(),
+                    help='number of worker processes, default number of cores')
+    ap.add_argument('-p','--profiles', type=int, nargs='+',
+                    help='square output sizes, e.g. 224 512, saved in a directory '
+                    'per size, default a single 900 pixel output')
+    ap.add_argument('-pk','--pack', action='store_true',
+                    help='save the images of every profile into one packed array '
+                    'instead of separate image files, requires --profiles')
+    ap.add_argument('-in','--incremental', action='store_true',
+                    help='resize only new and changed images and remove resized '
+                    'images of removed sources')
+    ap.add_argument('-sd','--shard',
+                    help='shard k/N of the images to resize, by the hash of their '
+                    'photo id, for work queue workers')
+    args = vars(ap.parse_args())
 
-# define function to crop image
-def center_crop(img, new_width=None, new_height=None):        
+    # check that images are given
+    if args['input'] is None and args['store'] is None:
+        ap.error('either --input or --store is required')
 
-    width = img.shape[1]
-    height = img.shape[0]
-    
-    # if no desired width set the smaller value of initial size chosen
-    if new_width is None:
-        new_width = min(width, height)
-    
-    # if no desired heigth set the smaller value of initial size chosen
-    if new_height is None:
-        new_height = min(width, height)
-    
-    # set new sizes for left and right sides of image
-    left = int(np.ceil((width - new_width) / 2))
-    right = width - int(np.floor((width - new_width) / 2))
-    
-    # set new sizes for top and bottom sides of image
-    top = int(np.ceil((height - new_height) / 2))
-    bottom = height - int(np.floor((height - new_height) / 2))
-    
-    # center crop image
-    if len(img.shape) == 2:
-        center_cropped_img = img[top:bottom, left:right]
+    # packed arrays need a fixed image size
+    if args['pack'] and args['profiles'] is None:
+        ap.error('--pack requires --profiles')
+
+    # packed arrays are always written in full
+    if args['pack'] and args['incremental']:
+        ap.error('--incremental cannot be used with --pack')
+
+    # shards write into a shared output, indexed when merged
+    if args['shard'] is not None and (args['pack'] or args['incremental']):
+        ap.error('--shard cannot be used with --pack or --incremental')
+
+    # resolve image paths, park and file names through the image store
+    if args['store'] is not None:
+        print('[INFO] - Retrieving all image paths from image store...')
+        images = [(path, park, fname) for pid, fname, park, path
+                  in ImageStore(args['store']).images()]
+
+    # or read image paths from index of input directory
+    elif ImageIndex.exists(args['input']):
+        print('[INFO] - Retrieving all image paths from image index...')
+        images = [(path, park, fname) for pid, park, fname, path
+                  in ImageIndex(args['input']).images()]
+
+    # or retrieve image paths from directory structure
     else:
-        center_cropped_img = img[top:bottom, left:right, ...]
+        print('[INFO] - Retrieving all image paths in directory structure...')
+        images = [(path, park_of(args['input'], path), os.path.basename(path))
+                  for path in paths.list_images(args['input'])]
 
-    return center_cropped_img
+    # take the shard of the images of a work queue worker
+    if args['shard'] is not None:
+        images = take_shard(images, args['shard'],
+                            key=lambda image: pid_from_filename(image[2]))
+        print('[INFO] - Resizing shard ' + args['shard'] + ' of ' +
+              str(len(images)) + ' images')
 
-# retrieve image paths
-print('[INFO] - Retrieving all image paths in directory structure...')
-imagePaths = list(paths.list_images(args['input']))
+    # output directories and indexes of resizing profiles
+    if args['profiles'] is not None:
+        roots = dict((size, profile_root(args['output'], size)) for size in args['profiles'])
+    else:
+        roots = {900: args['output']}
 
-# extract park names for directory creation
-print('[INFO] - Retrieving park names...')
-parknames = []
-for path in imagePaths:
-    park = path.split(os.path.sep)[-2]
-    parknames.append(park)
+    # allocate one packed array per profile with a row for every image
+    if args['pack']:
+        print('[INFO] - Allocating packed arrays for resized images...')
+        indexes = {}
+        rows = [(pid_from_filename(fname), park, fname) for path, park, fname in images]
+        packs = dict((size, create_pack(root, rows, size)) for size, root in roots.items())
+        jobs = [(path, dict((size, (packs[size], n)) for size in roots))
+                for n, (path, park, fname) in enumerate(images)]
+        resize = pack_file_profiles
 
-# create dirs for resized images
-print('[INFO] - Creating directories for resized images...')
-for park in parknames:
-    target_path = os.path.join(args['output'], park)
-    os.makedirs(target_path, exist_ok=True)
+    # or create directories and indexes for resized image files
+    else:
+        # shards leave indexing to the merge, as the index is not shared safely
+        if args['shard'] is None:
+            indexes = dict((size, ImageIndex(root)) for size, root in roots.items())
+        else:
+            indexes = {}
 
-# initialize progress indicator
-i = 1
+        # remember created directories
+        createdirs = set()
 
-# resize and keep aspect ration
-print('[INFO] - Resizing and saving resized images...')
-for path in imagePaths:
-    
-    print('[INFO] - Resizing ' + str(i) + '/' + str(len(imagePaths)) + ' image')
-    # fetch park and file names
-    park, fname = path.split(os.path.sep)[-2:]
-    
-    # open image
-    img = Image.open(path)
-    
-    # resize and keep aspect ratio
-    img.thumbnail((900,900),Image.ANTIALIAS)
-    
-    # convert to array
-    img = np.array(img)
-    
-    # center crop the array
-    img = center_crop(img)
-    
-    # convert back to image
-    img = Image.fromarray(np.uint8(img))
-    
-    # save to file
-    img.save(os.path.join(args['output'], park, fname))
-    i += 1
+        # list of resize jobs and their index rows
+        jobs = []
+        rows = []
+
+        # create directories for resized images
+        print('[INFO] - Creating directories for resized images...')
+        for path, park, fname in images:
+            pid = pid_from_filename(fname)
+            dsts = {}
+            for size, root in roots.items():
+                target_path = shard_dir(root, park, pid, args['fanout'])
+                if target_path not in createdirs:
+                    os.makedirs(target_path, exist_ok=True)
+                    createdirs.add(target_path)
+                dsts[size] = os.path.join(target_path, fname)
+            jobs.append((path, dsts))
+            rows.append((pid, park, fname))
+
+        # skip images resized from the same source in a previous run
+        if args['incremental']:
+            print('[INFO] - Comparing source images to resize manifest...')
+            manifest = ResizeManifest(os.path.join(args['output'], MANIFEST_NAME))
+            known = manifest.sources()
+            stats = {}
+            changed = []
+            for job, row in zip(jobs, rows):
+                st = os.stat(job[0])
+                current = all(known.get((row[0], size), (None, None, None))[:2] ==
+                              (st.st_size, st.st_mtime) and os.path.exists(dst)
+                              for size, dst in job[1].items())
+                if not current:
+                    changed.append((job, row))
+                    stats[row[0]] = (st.st_size, st.st_mtime)
+            print('[INFO] - Skipping ' + str(len(jobs) - len(changed)) +
+                  ' unchanged images')
+            jobs = [job for job, row in changed]
+            rows = [row for job, row in changed]
+
+            # remove resized images whose source is gone
+            pids = set(pid_from_filename(fname) for path, park, fname in images)
+            removed = 0
+            for (pid, profile), (size, mtime, path) in known.items():
+                if pid in pids or profile not in indexes:
+                    continue
+                if os.path.exists(path):
+                    os.remove(path)
+                indexes[profile].remove(pid)
+                manifest.remove(pid, profile)
+                removed += 1
+            print('[INFO] - Removed ' + str(removed) + ' resized images of removed sources')
+
+        # legacy single output is fitted, profiles are exact squares
+        if args['profiles'] is None:
+            resize, jobs = resize_file, [(path, dsts[900], 900) for path, dsts in jobs]
+        else:
+            resize = resize_file_profiles
+
+    # initialize progress indicator
+    i = 1
+
+    # resize and keep aspect ration on all cores
+    print('[INFO] - Resizing and saving resized images...')
+    with ProcessPoolExecutor(max_workers=args['workers']) as pool:
+        for (pid, park, fname), results in zip(
+                rows, pool.map(resize, jobs, chunksize=16)):
+            
+            print('[INFO] - Resized ' + str(i) + '/' + str(len(jobs)) + ' image')
+            
+            # add resized image files to indexes
+            if args['profiles'] is None:
+                results = [results]
+            if not args['pack']:
+                for profile, (outpath, size, mtime) in zip(roots, results):
+                    if profile not in indexes:
+                        continue
+                    indexes[profile].add(pid, park, fname, outpath, size, mtime)
+                    
+                    # record source of resized image
+                    if args['incremental']:
+                        manifest.record(pid, profile, *stats[pid], outpath)
+            i += 1
+
+    # save indexes
+    for index in indexes.values():
+        index.close()
+    if args['incremental']:
+        manifest.close()
 
-print('[INFO] - ... done!')
\ No newline at end of file
+    print('[INFO] - ... done!')
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 11:20:05 2026
+
+INFORMATION
+===========
+
+This module contains the resizing and center cropping functions shared by
+resize_photos.py and the streaming mode of image_download.py.
+
+Resizing profiles produce exactly the square input size of a computer vision
+model, e.g. 224 x 224 for ResNeXt101 and VGG16-Places365 or 512 x 512 for Mask
+r-CNN, from a single decode of the image. Each profile is saved in its own
+directory named after its size (e.g. output/224px/), and the computer vision
+scripts pick the variant matching their model with variant_root() and
+variant_path().
+
+"""
+
+from PIL import Image
+import numpy as np
+import re
+import os
+
+
+# directory name of resizing profiles
+PROFILE_DIR = '{}px'
+
+# pattern matching profile directory names
+PROFILE_RE = re.compile(r'^\d+px$')
+
+
+# define function to crop image
+def center_crop(img, new_width=None, new_height=None):        
+
+    width = img.shape[1]
+    height = img.shape[0]
+    
+    # if no desired width set the smaller value of initial size chosen
+    if new_width is None:
+        new_width = min(width, height)
+    
+    # if no desired heigth set the smaller value of initial size chosen
+    if new_height is None:
+        new_height = min(width, height)
+    
+    # set new sizes for left and right sides of image
+    left = int(np.ceil((width - new_width) / 2))
+    right = width - int(np.floor((width - new_width) / 2))
+    
+    # set new sizes for top and bottom sides of image
+    top = int(np.ceil((height - new_height) / 2))
+    bottom = height - int(np.floor((height - new_height) / 2))
+    
+    # center crop image
+    if len(img.shape) == 2:
+        center_cropped_img = img[top:bottom, left:right]
+    else:
+        center_cropped_img = img[top:bottom, left:right, ...]
+
+    return center_cropped_img
+
+
+def crop_box(width, height):
+    """Return the box of the centered square of an image, rounded like
+    center_crop."""
+    side = min(width, height)
+    left = int(np.ceil((width - side) / 2))
+    top = int(np.ceil((height - side) / 2))
+    return (left, top, left + side, top + side)
+
+
+def resize_crop(img, size=900):
+    """Resize PIL image to fit size x size keeping the aspect ratio and center
+    crop it to a square.
+
+    JPEG images are decoded at the smallest DCT scale that is still at least
+    as large as the result, and only the centered square is resampled, so
+    pixels that would be cropped away are neither decoded at full size nor
+    resampled.
+    """
+    # size of the aspect preserving thumbnail, never enlarging the image
+    width, height = img.size
+    scale = min(size / max(width, height), 1)
+    thumb = (max(1, round(width * scale)), max(1, round(height * scale)))
+
+    # let the JPEG decoder downscale while decoding
+    img.draft(img.mode, thumb)
+
+    # crop the centered square of the decoded image and resample it
+    side = min(thumb)
+    box = crop_box(*img.size)
+    if box[2] - box[0] == side:
+        return img.crop(box)
+    return img.resize((side, side), Image.LANCZOS, box=box)
+
+
+def resize_file(job):
+    """Resize and crop the image file src and save it to dst. Meant to be run
+    in worker processes. Returns dst with size and modification time of the
+    saved file."""
+    src, dst, size = job
+    with Image.open(src) as img:
+        resize_crop(img, size).save(dst)
+    st = os.stat(dst)
+    return dst, st.st_size, st.st_mtime
+
+
+def resize_profiles(img, sizes):
+    """Return dict of size x size center crops of a PIL image for every size
+    in sizes, decoding the image only once."""
+    # let the JPEG decoder downscale while keeping the largest size covered
+    width, height = img.size
+    scale = max(sizes) / min(width, height)
+    img.draft(img.mode, (int(np.ceil(width * scale)), int(np.ceil(height * scale))))
+
+    # resample the centered square to every size
+    box = crop_box(*img.size)
+    return dict((size, img.resize((size, size), Image.LANCZOS, box=box))
+                for size in sizes)
+
+
+def resize_file_profiles(job):
+    """Resize the image file src to every profile and save them. dsts is a
+    dict of profile sizes and output paths. Meant to be run in worker
+    processes. Returns list of (dst, file size, modification time) tuples in
+    the order of dsts."""
+    src, dsts = job
+    with Image.open(src) as img:
+        resized = resize_profiles(img, list(dsts))
+    results = []
+    for size, dst in dsts.items():
+        resized[size].save(dst)
+        st = os.stat(dst)
+        results.append((dst, st.st_size, st.st_mtime))
+    return results
+
+
+def profile_root(root, size):
+    """Directory of a resizing profile below an output directory."""
+    return os.path.join(root, PROFILE_DIR.format(size))
+
+
+def variant_root(root, size):
+    """Return the directory of the size profile below root if it exists,
+    otherwise root itself."""
+    path = profile_root(root, size)
+    return path if os.path.isdir(path) else root
+
+
+def variant_path(path, size):
+    """Return the path of the size profile variant of a resized image if it
+    exists, otherwise the path itself."""
+    parts = path.split(os.path.sep)
+    for n in range(len(parts) - 1, -1, -1):
+        if PROFILE_RE.match(parts[n]):
+            parts[n] = PROFILE_DIR.format(size)
+            variant = os.path.sep.join(parts)
+            return variant if os.path.exists(variant) else path
+    return path
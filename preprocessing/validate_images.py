@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 20:34:06 2026
+
+INFORMATION
+===========
+This script validates the images of an image directory before the computer
+vision stages. Every image is fully decoded once on all cores, so truncated
+downloads and otherwise corrupt files are found before they can crash a long
+computer vision run.
+
+The width, height, color mode and validity of every image are recorded in the
+index file of the image directory (see image_index.py). Invalid images are
+moved to a quarantine directory and left out of the image lists read by
+resize_photos.py and the computer vision scripts. Only images added or changed
+since the previous validation are decoded again.
+
+USAGE
+=====
+Run the script by running the following command:
+
+    python3 validate_images.py -i path/to/image/directory
+
+Invalid images are moved to path/to/image/directory_quarantine by default.
+Give another quarantine directory by running:
+
+    python3 validate_images.py -i path/to/image/directory -q path/to/quarantine
+
+Validate all images again, e.g. after a Pillow upgrade, by running:
+
+    python3 validate_images.py -i path/to/image/directory -a
+
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from image_index import ImageIndex, IMAGE_ERRORS
+from PIL import Image
+import shutil
+import os
+import argparse
+
+
+def validate_file(path):
+    """Fully decode an image file. Returns (width, height, mode, valid)."""
+    try:
+        with Image.open(path) as img:
+            img.load()
+            return img.width, img.height, img.mode, True
+    except IMAGE_ERRORS:
+        return None, None, None, False
+
+
+# run only in the main process, not in the worker processes
+if __name__ == '__main__':
+
+    # define arguments
+    ap = argparse.ArgumentParser()
+    ap.add_argument('-i','--input', required=True,
+                    help='path to input image directory')
+    ap.add_argument('-q','--quarantine',
+                    help='path to directory for invalid images, default input '
+                    'directory name with _quarantine appended')
+    ap.add_argument('-a','--all', action='store_true',
+                    help='validate all images again, not only new and changed ones')
+    ap.add_argument('-w','--workers', type=int, default=os.cpu_count(),
+                    help='number of worker processes, default number of cores')
+    args = vars(ap.parse_args())
+
+    # set default quarantine directory next to the input directory
+    if args['quarantine'] is None:
+        args['quarantine'] = os.path.normpath(args['input']) + '_quarantine'
+
+    # bring image index up to date with the directories
+    print('[INFO] - Updating image index...')
+    index = ImageIndex(args['input'])
+    index.scan()
+
+    # list images to validate
+    images = index.unvalidated(args['all'])
+    print('[INFO] - Validating ' + str(len(images)) + ' images...')
+
+    # list of invalid images
+    invalid = []
+
+    # decode images on all cores
+    with ProcessPoolExecutor(max_workers=args['workers']) as pool:
+        for (pid, path), (width, height, mode, valid) in zip(
+                images, pool.map(validate_file, [path for pid, path in images],
+                                 chunksize=32)):
+
+            # record result in index
+            index.set_valid(pid, width, height, mode, valid)
+            if not valid:
+                invalid.append(path)
+
+    # move invalid images to quarantine keeping their park directories
+    print('[INFO] - Moving ' + str(len(invalid)) + ' invalid images to quarantine...')
+    for path in invalid:
+        target = os.path.join(args['quarantine'], os.path.relpath(path, args['input']))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.move(path, target)
+
+    # save index
+    index.close()
+
+    print('[INFO] - ... done!')
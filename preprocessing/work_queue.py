@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 00:24:53 2026
+
+INFORMATION
+===========
+
+This module contains a file-based work queue for running a stage on several
+machines sharing a filesystem, without any broker. The photos of a stage are
+split into N shards by the CRC-32 hash of their photo id, so every machine
+puts every photo into the same shard no matter in which order it lists them.
+Scripts process a single shard with --shard k/N.
+
+The queue directory holds a lock file per claimed shard and a done file per
+finished shard:
+
+    queue/shard_3.lock
+    queue/shard_0.done
+
+A shard is claimed by creating its lock file exclusively, which only one
+worker can do. While the shard is processed, a background thread touches the
+lock file every heartbeat seconds. A lock file not touched for timeout seconds
+belongs to a dead worker and the shard is put back into the queue by the next
+worker looking for work. Keep the timeout well above the heartbeat and any
+clock differences between the machines.
+
+A worker that was only slow, e.g. suspended, may find its shard claimed by
+another worker when it resumes. Every heartbeat, completion and release first
+checks that the lock file still holds the token of the worker. A worker that
+lost its claim sets the lost event, stops touching the lock and never marks
+the shard done or removes the lock of the new owner.
+
+See queue_worker.py for running workers and merging their outputs.
+
+"""
+
+import pandas as pd
+import threading
+import socket
+import zlib
+import uuid
+import time
+import os
+
+
+def shard_of(pid, n):
+    """Shard number of a photo id among n shards."""
+    return zlib.crc32(pid.encode('utf-8')) % n
+
+
+def parse_shard(shard):
+    """Return (shard number, number of shards) of a 'k/N' shard string."""
+    k, n = shard.split('/')
+    return int(k), int(n)
+
+
+def take_shard(items, shard, key):
+    """Return the items whose key falls into the shard of a 'k/N' string."""
+    k, n = parse_shard(shard)
+    return [item for item in items if shard_of(key(item), n) == k]
+
+
+def take_shard_frame(df, shard, key='photoid'):
+    """Return the rows of a dataframe whose key falls into the shard of a
+    'k/N' string."""
+    k, n = parse_shard(shard)
+    mask = df[key].map(lambda pid: shard_of(pid, n) == k)
+    return df[mask.values].reset_index(drop=True)
+
+
+class WorkQueue:
+    """Lock file based queue of the shards of a stage."""
+
+    def __init__(self, root, shards, timeout=600, heartbeat=60):
+        self.root = root
+        self.shards = shards
+        self.timeout = timeout
+        self.heartbeat = heartbeat
+        self.token = '{}:{}:{}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex)
+        self.claimed = None
+        self.stop = threading.Event()
+        self.lost = threading.Event()
+        self.thread = None
+        os.makedirs(root, exist_ok=True)
+
+    def _lock(self, k):
+        return os.path.join(self.root, 'shard_{}.lock'.format(k))
+
+    def _done(self, k):
+        return os.path.join(self.root, 'shard_{}.done'.format(k))
+
+    def done(self):
+        """Set of finished shards."""
+        return set(k for k in range(self.shards) if os.path.exists(self._done(k)))
+
+    def missing(self):
+        """List of shards not finished yet."""
+        done = self.done()
+        return [k for k in range(self.shards) if k not in done]
+
+    def _requeue(self, k):
+        # leave live claims alone
+        lock = self._lock(k)
+        try:
+            with open(lock) as f:
+                token = f.read()
+            if time.time() - os.stat(lock).st_mtime < self.timeout:
+                return
+        except FileNotFoundError:
+            return
+
+        # move the stale lock out of the way, only one worker can do this
+        moved = '{}.stale.{}'.format(lock, uuid.uuid4().hex)
+        try:
+            os.rename(lock, moved)
+        except FileNotFoundError:
+            return
+
+        # put back a fresh claim that replaced the stale one in the meantime
+        with open(moved) as f:
+            if f.read() != token:
+                try:
+                    os.link(moved, lock)
+                except FileExistsError:
+                    pass
+        os.remove(moved)
+        print('[INFO] - Re-queued shard ' + str(k) + ' of dead worker ' + token)
+
+    def claim(self, skip=()):
+        """Claim the next shard that is neither finished nor claimed by a live
+        worker, re-queueing stale claims. Returns its number or None."""
+        for k in self.missing():
+            if k in skip:
+                continue
+            self._requeue(k)
+            try:
+                fd = os.open(self._lock(k), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                continue
+
+            # a worker may have finished the shard after it was listed
+            if os.path.exists(self._done(k)):
+                os.close(fd)
+                os.remove(self._lock(k))
+                continue
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.token)
+
+            # keep the claim alive
+            self.claimed = k
+            self.stop.clear()
+            self.lost.clear()
+            self.thread = threading.Thread(target=self._beat, args=(k,), daemon=True)
+            self.thread.start()
+            return k
+        return None
+
+    def owns(self, k):
+        """Check whether the lock of shard k still holds the token of this
+        worker."""
+        try:
+            with open(self._lock(k)) as f:
+                return f.read() == self.token
+        except FileNotFoundError:
+            return False
+
+    def _beat(self, k):
+        while not self.stop.wait(self.heartbeat):
+            if not self.owns(k):
+                self.lost.set()
+                return
+            os.utime(self._lock(k))
+
+    def _remove_lock(self, k):
+        # move the lock out of the way and put it back if it is not ours
+        lock = self._lock(k)
+        moved = '{}.unclaim.{}'.format(lock, uuid.uuid4().hex)
+        try:
+            os.rename(lock, moved)
+        except FileNotFoundError:
+            return
+        with open(moved) as f:
+            if f.read() != self.token:
+                try:
+                    os.link(moved, lock)
+                except FileExistsError:
+                    pass
+        os.remove(moved)
+
+    def _unclaim(self):
+        self.stop.set()
+        self.thread.join()
+        self._remove_lock(self.claimed)
+        self.claimed = None
+
+    def complete(self):
+        """Mark the claimed shard as finished if the claim is still held.
+        Returns False if another worker took the shard over."""
+        if self.lost.is_set() or not self.owns(self.claimed):
+            self.lost.set()
+            self._unclaim()
+            return False
+        with open(self._done(self.claimed), 'w') as f:
+            f.write('{} {}'.format(self.token, time.strftime('%Y-%m-%d %H:%M:%S')))
+        self._unclaim()
+        return True
+
+    def release(self):
+        """Put the claimed shard back into the queue, unless another worker
+        took it over."""
+        self._unclaim()
+
+    def pending(self):
+        """Number of unfinished shards claimed by other workers."""
+        return sum(1 for k in self.missing() if os.path.exists(self._lock(k)))
+
+
+def merge_pickles(paths, key='photoid'):
+    """Concatenate pickled shard outputs in key order."""
+    df = pd.concat([pd.read_pickle(p) for p in paths], ignore_index=True)
+    return df.sort_values(key, kind='stable').reset_index(drop=True)
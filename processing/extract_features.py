@@ -7,7 +7,36 @@ INFORMATION
 
 This script extracts features from Flickr images with ResNeXt101 pretrained with
 ImageNet and saves results into a pickled dataframe. The dataframe will also
-contain the file paths to the images.
+contain the file paths to the images. If the image directory has an index file
+written by resize_photos.py, the image paths are read from it instead of
+listing the directories, leaving out images that failed validate_images.py.
+Images that cannot be read are skipped. Batches are loaded on worker threads
+while the model runs on the previous batch. If the image directory has a 224px
+profile directory written by resize_photos.py --profiles, the images are read
+from it as they are already the input size of ResNeXt101.
+
+The features can also be saved into a feature store (see feature_store.py),
+a contiguous float32 or float16 matrix next to a slim metadata table. The
+output pickle then holds only the image paths, photo ids and feature matrix
+rows, and later stages read the features only when they need them.
+
+Long runs can be checkpointed (see checkpoint.py). Results are then flushed to
+disk every few batches, and a crashed or stopped run continues from where it
+left off when started again with the same checkpoint directory. Photos added
+to the image directory since the previous run are processed alone in the same
+way.
+
+On CPU nodes with many cores the work can be split between several worker
+processes, each running its own model on its own part of the photos (see
+data_parallel.py). The outputs of the workers are merged in photo id order,
+and the throughput and scaling efficiency of every run are logged in
+scaling.csv in the output directory.
+
+With --places the scene categories of predict_places365.py are predicted in the
+same pass. Every image is then decoded once and the decoded batch is fed to
+both ResNeXt101 and VGG16-Places365 with their own preprocessing. The three
+most confident scenes and the best scene with its confidence are added to the
+output as the scenepreds, scenecat and sceneprob columns.
 
 
 USAGE
@@ -16,22 +45,68 @@ USAGE
 Run script by typing
     python extract_features.py -i path/to/image/directory/ -o outputfile.pkl -b 32
 
+Extract features only for new and changed photos of a master merge (see
+combine_data.py) by typing
+    python extract_features.py -i path/to/image/directory/ -o outputfile.pkl -de delta.csv
+
+Read the images from the packed array of resize_photos.py --pack instead of
+separate image files by typing
+    python extract_features.py -i path/to/image/directory/ -o outputfile.pkl -pk path/to/resized/directory
+
+Load images on 8 threads and keep up to 16 batches ready by typing
+    python extract_features.py -i path/to/image/directory/ -o outputfile.pkl -w 8 -pf 16
+
+The loader and model times are reported at the end. If the model mostly waits
+for the loader, add workers.
+
+Save the features as float16 into a feature store by typing
+    python extract_features.py -i path/to/image/directory/ -o outputfile.pkl -fs features/ -dt float16
+
+Flush results to a checkpoint directory every 100 batches by typing
+    python extract_features.py -i path/to/image/directory/ -o outputfile.pkl -cp checkpoint/ -ce 100
+
+Run 4 worker processes with 8 threads each by typing
+    python extract_features.py -i path/to/image/directory/ -o outputfile.pkl -j 4 -th 8
+
+Process only shard 3 of 64 by the hash of the photo ids, e.g. as a worker of
+queue_worker.py, by typing
+    python extract_features.py -i path/to/image/directory/ -o outputfile_3.pkl -sd 3/64
+
+Predict scene categories with VGG16-Places365 from the same decoded images by
+typing
+    python extract_features.py -i path/to/image/directory/ -o outputfile.pkl -pl
+
 
 @author: Tuomas Väisänen
 """
 
-from keras.preprocessing.image import img_to_array 
 from keras.preprocessing.image import load_img
 from keras.layers import Input
-from imutils import paths
 import numpy as np
 import pandas as pd
 import progressbar
 import argparse
 import os
+import sys
+import time
 import keras
 from keras_applications.resnext import ResNeXt101, preprocess_input
 
+# make the shared modules of the preprocessing scripts importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, 'preprocessing'))
+from image_index import list_images, IMAGE_ERRORS
+from resize_utils import variant_root
+from image_pack import PackReader
+from flickr_ids import path_filename, pid_from_filename
+from gpkg_sql import read_delta
+from batch_loader import BatchLoader
+from feature_store import FeatureWriter, merge_stores
+from checkpoint import Checkpoint
+from data_parallel import (take_part, part_path, default_threads, run_parts,
+                           merge_parts, remove_parts, report_scaling, part_siblings)
+from work_queue import take_shard
+
 # define arguments
 ap = argparse.ArgumentParser()
 ap.add_argument('-i','--input',required=True,
@@ -40,8 +115,64 @@ ap.add_argument('-o','--output',required=True,
                 help='path to output pickled dataframe')
 ap.add_argument('-b','--batchsize', type=int, default=32,
                 help='batch size of images to be passed through network, default 32')
+ap.add_argument('-de','--delta',
+                help='delta file from combine_data.py --master, processes only '
+                'inserted and updated photos')
+ap.add_argument('-pk','--pack',
+                help='path to output directory of resize_photos.py --pack to read '
+                'images from')
+ap.add_argument('-w','--workers', type=int, default=4,
+                help='number of image loading threads, default 4')
+ap.add_argument('-pf','--prefetch', type=int, default=4,
+                help='number of batches loaded ahead of the model, default 4')
+ap.add_argument('-fs','--featurestore',
+                help='path to feature store directory to save the features into '
+                'instead of the output pickle')
+ap.add_argument('-dt','--dtype', default='float32', choices=['float32', 'float16'],
+                help='data type of features in feature store, default float32')
+ap.add_argument('-cp','--checkpoint',
+                help='path to checkpoint directory to flush results to and to '
+                'continue previous runs from')
+ap.add_argument('-ce','--checkpointevery', type=int, default=50,
+                help='number of batches between checkpoint flushes, default 50')
+ap.add_argument('-j','--jobs', type=int, default=1,
+                help='number of data-parallel worker processes, default 1')
+ap.add_argument('-th','--threads', type=int,
+                help='number of intra-op threads per worker process, default '
+                'number of cores divided by jobs')
+ap.add_argument('-pa','--part',
+                help='part k/N of the photos to process, set by --jobs for its '
+                'worker processes')
+ap.add_argument('-sd','--shard',
+                help='shard k/N of the photos to process, by the hash of their '
+                'photo id, for work queue workers')
+ap.add_argument('-pl','--places', action='store_true',
+                help='predict scene categories with VGG16-Places365 from the same '
+                'decoded images')
 args = vars(ap.parse_args())
 
+# start time of run for the scaling report
+start = time.time()
+
+# run data-parallel worker processes and merge their outputs in photo id order
+if args['jobs'] > 1:
+    threads = args['threads'] or default_threads(args['jobs'])
+    print('[INFO] - Running ' + str(args['jobs']) + ' worker processes...')
+    run_parts(args['jobs'], threads, {'-o': args['output'], '-fs': args['featurestore'],
+                                      '-cp': args['checkpoint']})
+    df = merge_parts(args['output'], args['jobs'])
+    
+    # merge feature stores of workers
+    if args['featurestore'] is not None:
+        df = merge_stores([part_path(args['featurestore'], k) for k in range(args['jobs'])],
+                          args['featurestore'], args['dtype'])
+        remove_parts(args['featurestore'], args['jobs'])
+    
+    df.to_pickle(args['output'])
+    report_scaling(args['output'], 'extract_features.py', args['jobs'], threads,
+                   len(df), time.time() - start)
+    sys.exit()
+
 # store the batch size in a convenience variable
 bs = args['batchsize']
 
@@ -54,9 +185,63 @@ model = ResNeXt101(input_tensor=inp, include_top=False, weights='imagenet',
                    models=keras.models, utils=keras.utils, pooling='max')
 print('[INFO] - ResNeXt101 trained on ImageNet loaded!')
 
+# load scene model and its class labels
+if args['places']:
+    
+    # import the VGG16-Places365 model from the computer vision scripts
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 os.pardir, 'cv'))
+    from vgg16_places_365 import VGG16_Places365
+    from places_utils import preprocess_input as places_preprocess_input
+    
+    places = VGG16_Places365(weights='places')
+    print('[INFO] - VGG16 trained on Places365 loaded!')
+    
+    # download classlabels if not present in directory
+    file_name = 'categories_places365.txt'
+    if not os.access(file_name, os.W_OK):
+        print('[INFO] - Downloading class label file')
+        synset_url = 'https://raw.githubusercontent.com/csailvision/places365/master/categories_places365.txt'
+        os.system('wget ' + synset_url)
+    
+    # read class labels into tuple
+    with open(file_name) as class_file:
+        classes = tuple(line.strip().split(' ')[0][3:] for line in class_file)
+
 # grab list of image paths
 print('[INFO] - Loading images..')
-imagePaths = list(paths.list_images(args['input']))
+if args['pack'] is not None:
+    pack = PackReader(variant_root(args['pack'], 224))
+    imagePaths = pack.paths()
+else:
+    imagePaths = list_images(variant_root(args['input'], 224))
+
+# keep only new and changed photos of a master merge
+if args['delta'] is not None:
+    deltapids = read_delta(args['delta'])
+    imagePaths = [p for p in imagePaths
+                  if pid_from_filename(os.path.basename(p)) in deltapids]
+
+# take the shard of the photos of a work queue worker
+if args['shard'] is not None:
+    imagePaths = take_shard(imagePaths, args['shard'],
+                            key=lambda p: pid_from_filename(os.path.basename(p)))
+
+# take the part of the photos of a data-parallel worker
+if args['part'] is not None:
+    imagePaths = take_part(imagePaths, args['part'],
+                           key=lambda p: pid_from_filename(os.path.basename(p)))
+
+# skip photos done in previous runs, remembering all photos of this run
+if args['checkpoint'] is not None:
+    checkpoint = Checkpoint(args['checkpoint'], args['checkpointevery'],
+                            others=part_siblings(args['checkpoint']))
+    done = checkpoint.done()
+    selected = set(pid_from_filename(os.path.basename(p)) for p in imagePaths)
+    imagePaths = [p for p in imagePaths
+                  if pid_from_filename(os.path.basename(p)) not in done]
+    print('[INFO] - Skipping ' + str(len(selected) - len(imagePaths)) +
+          ' photos done in previous runs')
 
 # message about defining the result dataframe
 print('[INFO] - Defining dataframe..')
@@ -64,31 +249,18 @@ print('[INFO] - Defining dataframe..')
 # create column names according to output dimensionality
 featurecols = ['feature'+str(i) for i in range(model.output.shape[1].value)]
 
-# create empty dataframe
-df = pd.DataFrame(None, columns=featurecols)
+# create empty dataframe, features of a feature store are kept out of it
+df = pd.DataFrame(None, columns=featurecols if args['featurestore'] is None else [])
 
 # add image paths to dataframe
 df['imagepath'] = imagePaths
 
 # extract the filenames and photo ids from the image paths
 print('[INFO] - Extracting unique photo ids..')
-fnames = [p.split(os.path.sep)[-1] for p in imagePaths]
-
-# empty list to append photo ids to
-pids = []
+df['filename'] = path_filename(df['imagepath'], os.path.sep)
 
-# loop over image paths to extract photoids
-for f in fnames:
-    
-    # remove trailing size and format strings
-    f = f[:-6] 
-    
-    # append the photo id to list
-    pids.append(f)
-
-# add file names and photo ids to dataframe
-df['filename'] = fnames
-df['photoid'] = pids
+# remove trailing size and format strings to get photo ids
+df['photoid'] = pid_from_filename(df['filename'])
 
 # initialize progressbar
 widgets = ['Extracting features with ImageNet pre-trained model: ',
@@ -100,8 +272,15 @@ pbar = progressbar.ProgressBar(maxval=len(imagePaths), widgets=widgets).start()
 # empty feature feature list
 features = []
 
-# loop over images in batches
-for i in np.arange(0, len(imagePaths), bs):
+# empty list for scene predictions
+scenes = []
+
+# list of unreadable images
+unreadable = []
+
+def load_batch(i):
+    """Load the batch of images starting at row i and preprocess it for every
+    model."""
     
     # extract batch of images and labels then initialize the list of actual images
     # that will be passed through the network for feature extraction
@@ -109,42 +288,139 @@ for i in np.arange(0, len(imagePaths), bs):
     batchLabels = df['photoid'][i:i + bs].values.tolist()
     batchImages = []
     
-    for (j, imagePath) in enumerate(batchPaths):
-        
-        # load input image and resize to 224x224
-        image = load_img(imagePath, target_size=(224,224))
-        
-        # convert to array
-        image = img_to_array(image)
-        
-        # preprocess image by expanding dimensions and subtracting mean RGB pixel
-        # intensity from ImageNet
-        image = np.expand_dims(image, axis=0)
-        image = preprocess_input(image, data_format='channels_last')
-        
-        # add the image to the batch
-        batchImages.append(image)
-        
-    # vertically stack the batch images
-    batchImages = np.vstack(batchImages)
+    # read consecutive rows of the packed array, or the rows of remaining photos
+    if args['pack'] is not None:
+        if len(df) == len(pack):
+            batchImages = pack.batch(i, i + bs)
+        else:
+            batchImages = pack.take(batchLabels)
+    
+    else:
+        for (j, imagePath) in enumerate(batchPaths):
+            
+            # load input image and resize to 224x224, use a blank image in
+            # place of an unreadable one and drop it afterwards
+            try:
+                image = load_img(imagePath, target_size=(224,224))
+            except IMAGE_ERRORS:
+                print('[INFO] - Skipping unreadable image ' + imagePath)
+                unreadable.append(imagePath)
+                image = np.zeros((224,224,3))
+            
+            # convert to array of 8-bit pixel values
+            batchImages.append(np.asarray(image, dtype='uint8'))
+            
+        # stack the decoded batch images
+        batchImages = np.stack(batchImages)
+    
+    # subtract mean RGB pixel intensity from ImageNet, on a copy as the
+    # preprocessing works in place
+    resnextImages = preprocess_input(batchImages.astype('float32'),
+                                     data_format='channels_last')
+    if not args['places']:
+        return resnextImages
+    
+    # feed the same decoded images to the scene model with its own preprocessing
+    return resnextImages, places_preprocess_input(batchImages.astype('float32'))
+
+# load batches on worker threads ahead of the model
+loader = BatchLoader(load_batch, np.arange(0, len(imagePaths), bs),
+                     workers=args['workers'], prefetch=args['prefetch'])
+
+# allocate feature matrix of feature store, or of all runs at the end
+if args['featurestore'] is not None and args['checkpoint'] is None:
+    writer = FeatureWriter(args['featurestore'], len(imagePaths), len(featurecols),
+                           args['dtype'])
+
+# loop over images in batches
+for i, batchImages in loader:
+    
+    # split the batch between the models
+    if args['places']:
+        batchImages, placesImages = batchImages
     
     # pass the batch images through network to get image features
     batchFeatures = model.predict(batchImages, batch_size=bs)
     
-    # add features and labels to dataset
-    features.extend(batchFeatures)
+    # predict scenes and keep the top 3 classes with confidences rounded to 3
+    # decimals
+    if args['places']:
+        batchPredictions = places.predict(placesImages, batch_size=bs)
+        scenes.extend([(classes[p], round(preds[p], 3))
+                       for p in np.argsort(preds)[::-1][0:3]]
+                      for preds in batchPredictions)
+    
+    # add features and labels to checkpoint, dataset or feature store
+    if args['checkpoint'] is not None:
+        batch = df[i:i + bs][['imagepath', 'filename', 'photoid']]
+        if args['places']:
+            batch = batch.assign(scenepreds=scenes[i:i + bs])
+        keep = ~batch['imagepath'].isin(unreadable).values
+        checkpoint.add(batch[keep], batchFeatures[keep])
+    elif args['featurestore'] is not None:
+        writer.write(i, batchFeatures)
+    else:
+        features.extend(batchFeatures)
     
     # update progressbar
     pbar.update(i)
 
 # finish progressbar
 pbar.finish()
+print('[INFO] - ' + loader.summary())
+
+# gather the results of all runs from the checkpoint
+if args['checkpoint'] is not None:
+    checkpoint.close()
+    df = checkpoint.results()
+    
+    # keep the photos of this run once, as the checkpoint may hold photos of
+    # other parts, shards or deltas
+    keep = (df['photoid'].isin(selected) &
+            ~df['photoid'].duplicated(keep='last')).values
+    df = df[keep].reset_index(drop=True)
+    
+    # stream the features of the kept rows shard by shard into the feature
+    # store, or into one matrix for the output pickle
+    if args['featurestore'] is not None:
+        writer = FeatureWriter(args['featurestore'], len(df), len(featurecols),
+                               args['dtype'])
+        checkpoint.copy_features(keep, writer.features)
+    else:
+        features = np.empty((len(df), len(featurecols)), dtype='float32')
+        checkpoint.copy_features(keep, features)
+
+# add scene predictions of this run to dataframe
+elif args['places']:
+    df['scenepreds'] = scenes
 
-# add extracted features to dataframe
+# add extracted features to dataframe, or their feature matrix rows
 print('[INFO] - Updating dataframe with extracted features')
-df[featurecols] = features
+if args['featurestore'] is not None:
+    df['row'] = np.arange(len(df))
+elif args['checkpoint'] is not None:
+    df = pd.concat([pd.DataFrame(features, columns=featurecols), df], axis=1)
+else:
+    df[featurecols] = features
+
+# drop unreadable images
+df = df[~df['imagepath'].isin(unreadable)]
+
+# get best scene predictions
+if args['places']:
+    df['scenecat'] = df['scenepreds'].str[0].str[0]
+    df['sceneprob'] = df['scenepreds'].str[0].str[1]
+
+# save features and metadata of feature store
+if args['featurestore'] is not None:
+    writer.close(df)
 
 # Save dataframe to pickle
 df.to_pickle(args['output'])
 
+# report throughput of a single process run, not of a part or shard
+if args['part'] is None and args['shard'] is None:
+    report_scaling(args['output'], 'extract_features.py', 1, os.cpu_count(),
+                   len(df), time.time() - start)
+
 print('[INFO] - .. done!')
\ No newline at end of file
@@ -24,6 +24,10 @@ Run this script with default values by typing:
 Run this script with modified values by typing e.g.:
     python reduce_dimensions.py -i input.pkl -c 2 -n 15 -d 0.5 -r 80 -v locstr -ov plot.png -o output.pkl
 
+Read the features from the feature store of extract_features.py for an input
+pickle joined from its metadata (see join_userdata.py) by typing:
+    python reduce_dimensions.py -i input.pkl -fs features/ -o output.pkl
+
 
 @author: tuomvais
 """
@@ -34,6 +38,13 @@ import seaborn as sns
 import matplotlib.pyplot as plt
 import argparse
 import umap
+import os
+import sys
+
+# make the shared modules of the preprocessing scripts importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, 'preprocessing'))
+from feature_store import FeatureStore
 
 # define arguments
 ap = argparse.ArgumentParser()
@@ -55,6 +66,9 @@ ap.add_argument('-ov','--outviz',
                 help='output directory for plot')
 ap.add_argument('-o','--output', required=True,
                 help='output pickle directory')
+ap.add_argument('-fs','--featurestore',
+                help='path to feature store of extract_features.py to read the '
+                'features from, the input then needs a row column')
 args = vars(ap.parse_args())
 
 # load extracted features in
@@ -75,8 +89,13 @@ N = len(df)
 # get randomized order copy of the dataframe
 df_rnd = df.loc[rndperm[:N],:].copy()
 
-# get columns with extracted features
-data = df_rnd[featurecols].values
+# get extracted features from the rows of the feature store
+if args['featurestore'] is not None:
+    data = FeatureStore(args['featurestore']).take(df_rnd['row'].values)
+
+# or from the columns with extracted features
+else:
+    data = df_rnd[featurecols].values
 
 # run UMAP
 print('[INFO] - Running UMAP...')